@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+"""
+    benchmarks.chart
+    ~~~~~~~~~~~~~~~~
+
+    Compares fetching ``/chart`` with fetching ``/makers``, ``/heatsinks``,
+    ``/fan-configs`` and ``/measurements`` and joining them, in total bytes
+    and latency. Latency is measured both when the responses are served from
+    snapshots (warm) and when they have to be rendered (cold). Run it as::
+
+        $ python benchmarks/chart.py [makers]
+
+"""
+
+from __future__ import print_function
+import json
+import os
+import sys
+
+from common import best_of, create_benchmark_app, fill_synthetic_data
+
+from cpucoolerchart._compat import to_native
+from cpucoolerchart.extensions import cache
+
+
+FOUR_CALLS = ['/makers', '/heatsinks', '/fan-configs', '/measurements']
+
+
+def fetch_four(client):
+    docs = [json.loads(to_native(client.get(path).data))
+            for path in FOUR_CALLS]
+    makers, heatsinks, fan_configs, measurements = [
+        dict((item['id'], item) for item in doc['items']) for doc in docs]
+    # The join the frontend has to do by itself.
+    joined = {}
+    for measurement in measurements.values():
+        fan_config = fan_configs[measurement['fan_config_id']]
+        heatsink = heatsinks[fan_config['heatsink_id']]
+        maker = makers[heatsink['maker_id']]
+        joined.setdefault(maker['id'], []).append(measurement)
+    return joined
+
+
+def fetch_chart(client):
+    return json.loads(to_native(client.get('/chart').data))
+
+
+def main(makers=20):
+    app, path = create_benchmark_app()
+    try:
+        with app.app_context():
+            counts = fill_synthetic_data(makers=makers)
+            client = app.test_client()
+            print('rows: ' + ', '.join(
+                '{0} {1}'.format(counts[name], name) for name in
+                ('Maker', 'Heatsink', 'FanConfig', 'Measurement')))
+            four_bytes = sum(len(client.get(path).data)
+                             for path in FOUR_CALLS)
+            chart_bytes = len(client.get('/chart').data)
+            gzip = {'Accept-Encoding': 'gzip'}
+            four_gzip = sum(len(client.get(path, headers=gzip).data)
+                            for path in FOUR_CALLS)
+            chart_gzip = len(client.get('/chart', headers=gzip).data)
+
+            def cold(fetch):
+                def run():
+                    cache.delete_many(*[
+                        'snapshot/1' + path for path in FOUR_CALLS +
+                        ['/chart']])
+                    fetch(client)
+                return run
+
+            results = [
+                ('bytes', four_bytes, chart_bytes),
+                ('bytes (gzip)', four_gzip, chart_gzip),
+                ('warm (ms)', best_of(lambda: fetch_four(client)),
+                 best_of(lambda: fetch_chart(client))),
+                ('cold (ms)', best_of(cold(fetch_four), number=3),
+                 best_of(cold(fetch_chart), number=3)),
+            ]
+            print('{0:<14}{1:>12}{2:>12}{3:>8}'.format(
+                '', '4 calls', '/chart', 'ratio'))
+            for name, four, chart in results:
+                print('{0:<14}{1:>12.1f}{2:>12.1f}{3:>8.2f}'.format(
+                    name, four, chart, float(chart) / four))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
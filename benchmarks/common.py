@@ -0,0 +1,102 @@
+"""
+    benchmarks.common
+    ~~~~~~~~~~~~~~~~~
+
+    Helpers shared by the benchmark scripts. The benchmarks run against an app
+    with a temporary SQLite database filled with synthetic data, so that they
+    don't need network access and can be scaled beyond the real data set.
+
+"""
+
+from datetime import datetime
+import os
+import random
+import sys
+from tempfile import mkstemp
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cpucoolerchart.app import create_app
+from cpucoolerchart.crawler import NOISE_LEVELS, CPU_POWER
+from cpucoolerchart.extensions import db
+from cpucoolerchart.models import (Maker, Heatsink, FanConfig, Measurement,
+                                   DataVersion)
+from cpucoolerchart.snapshots import publish_data_version
+
+
+def create_benchmark_app(**config):
+    """Returns a tuple of a new app using a temporary SQLite database and
+    the path of the database. The caller should remove the file when done.
+
+    """
+    path = mkstemp(suffix='.db')[1]
+    settings = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'CACHE_TYPE': 'simple',
+    }
+    settings.update(config)
+    return create_app(settings), path
+
+
+def fill_synthetic_data(makers=20, heatsinks=15, fan_configs=2, seed=0):
+    """Fills the database with synthetic data. Each heatsink has
+    *fan_configs* fan configs and each fan config has a measurement for every
+    combination of noise level and CPU power, so there are
+    ``makers * heatsinks * fan_configs * 16`` measurements in total.
+
+    """
+    rnd = random.Random(seed)
+    db.create_all()
+    rows = {Maker: [], Heatsink: [], FanConfig: [], Measurement: []}
+    for i in range(makers):
+        rows[Maker].append({'id': i + 1, 'name': 'Maker {0}'.format(i)})
+    for i in range(makers * heatsinks):
+        rows[Heatsink].append({
+            'id': i + 1,
+            'name': 'Heatsink {0}'.format(i),
+            'maker_id': i // heatsinks + 1,
+            'heatsink_type': rnd.choice(['flower', 'tower']),
+            'width': rnd.choice([None, rnd.uniform(90, 150)]),
+            'depth': rnd.choice([None, rnd.uniform(50, 140)]),
+            'height': rnd.choice([None, rnd.uniform(50, 170)]),
+            'weight': rnd.choice([None, rnd.uniform(300, 1200)]),
+            'price': rnd.choice([None, rnd.randint(10, 150) * 1000]),
+            'shop_count': rnd.choice([None, rnd.randint(1, 300)]),
+        })
+    for i in range(makers * heatsinks * fan_configs):
+        rows[FanConfig].append({
+            'id': i + 1,
+            'heatsink_id': i // fan_configs + 1,
+            'fan_size': rnd.choice([92, 120, 140]),
+            'fan_thickness': 25,
+            'fan_count': i % fan_configs + 1,
+        })
+    for fan_config in rows[FanConfig]:
+        for noise in NOISE_LEVELS:
+            for power in CPU_POWER:
+                rows[Measurement].append({
+                    'fan_config_id': fan_config['id'],
+                    'noise': noise,
+                    'power': power,
+                    'rpm_min': rnd.randint(500, 2000),
+                    'rpm_max': rnd.randint(2000, 2500),
+                    'cpu_temp_delta': round(rnd.uniform(30, 80), 1),
+                    'power_temp_delta': rnd.choice(
+                        [None, round(rnd.uniform(30, 80), 1)]),
+                })
+    for model in (Maker, Heatsink, FanConfig, Measurement):
+        db.session.execute(model.__table__.insert(), rows[model])
+    db.session.add(DataVersion(created_at=datetime.utcnow()))
+    db.session.commit()
+    publish_data_version()
+    return dict((model.__name__, len(rows[model])) for model in rows)
+
+
+def best_of(func, repeat=5, number=20):
+    """Returns the best average time in milliseconds of calling *func*
+    *number* times, out of *repeat* runs.
+
+    """
+    times = timeit.repeat(func, repeat=repeat, number=number)
+    return min(times) / number * 1000
@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+"""
+    benchmarks.frontier
+    ~~~~~~~~~~~~~~~~~~~
+
+    Measures how :func:`~cpucoolerchart.frontier.skyline` scales with the
+    number of measurements by enlarging the synthetic data set step by step.
+    The time per ``n log n`` should stay roughly constant. The naive
+    comparison of every pair is timed as well for the smaller sizes. Run it
+    as::
+
+        $ python benchmarks/frontier.py [makers ...]
+
+"""
+
+from __future__ import print_function
+import math
+import os
+import sys
+
+from common import best_of, create_benchmark_app, fill_synthetic_data
+
+from cpucoolerchart.frontier import get_points, skyline
+
+
+#: The largest number of points for which the naive algorithm is timed.
+NAIVE_LIMIT = 2000
+
+
+def naive_skyline(points):
+    keys = [point[:3] for point in points]
+    return [point for point, key in zip(points, keys) if not any(
+        all(x <= y for x, y in zip(other, key)) and other != key
+        for other in keys)]
+
+
+def main(*makers_list):
+    print('{0:>8}{1:>14}{2:>20}{3:>12}'.format(
+        'n', 'skyline (ms)', 'ns per n log n', 'naive (ms)'))
+    for makers in makers_list or (5, 10, 20, 40, 80):
+        app, path = create_benchmark_app()
+        try:
+            with app.app_context():
+                fill_synthetic_data(makers=makers)
+                points = get_points()[150][0]
+                n = len(points)
+                elapsed = best_of(lambda: skyline(points), repeat=3,
+                                  number=5)
+                naive = ''
+                if n <= NAIVE_LIMIT:
+                    naive = '{0:.1f}'.format(best_of(
+                        lambda: naive_skyline(points), repeat=1, number=1))
+                print('{0:>8}{1:>14.2f}{2:>20.1f}{3:>12}'.format(
+                    n, elapsed, elapsed * 1e6 / (n * math.log(n, 2)), naive))
+        finally:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
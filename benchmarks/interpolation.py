@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+"""
+    benchmarks.interpolation
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures how long it takes to estimate CPU temperatures for a batch of
+    random targets with :func:`~cpucoolerchart.interpolation.interpolate`,
+    once the grids of the current data version are loaded. Run it as::
+
+        $ python benchmarks/interpolation.py [queries] [makers]
+
+"""
+
+from __future__ import print_function
+import os
+import sys
+
+import numpy
+
+from common import best_of, create_benchmark_app, fill_synthetic_data
+
+from cpucoolerchart.interpolation import (GRID_NOISE_LEVELS, GRID_CPU_POWER,
+                                          get_grids, interpolate)
+
+
+def main(queries=1000, makers=20):
+    app, path = create_benchmark_app()
+    try:
+        with app.app_context():
+            counts = fill_synthetic_data(makers=makers)
+            grids = get_grids()
+            rnd = numpy.random.RandomState(0)
+            ids = rnd.choice(grids['fan_config_id'], queries)
+            noise = rnd.uniform(GRID_NOISE_LEVELS[0], GRID_NOISE_LEVELS[-1],
+                                queries)
+            power = rnd.uniform(GRID_CPU_POWER[0], GRID_CPU_POWER[-1],
+                                queries)
+            print('{0} fan configs, {1} queries'.format(
+                counts['FanConfig'], queries))
+            print('load grids (ms): {0:.3f}'.format(best_of(get_grids)))
+            print('interpolate (ms): {0:.3f}'.format(
+                best_of(lambda: interpolate(grids, ids, noise, power))))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,59 @@
+#! /usr/bin/env python
+"""
+    benchmarks.serialization
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the cost per row of serializing measurements, comparing
+    creating model instances and calling
+    :meth:`~cpucoolerchart.models.BaseModel.as_dict` on each of them with
+    :meth:`~cpucoolerchart.models.BaseModel.Query.all_as_dict`, which fetches
+    plain tuples. Rendering ``/measurements`` without its snapshot is timed
+    as well. The data set is about 10 and 100 times as large as the real one
+    by default. Run it as::
+
+        $ python benchmarks/serialization.py [makers ...]
+
+"""
+
+from __future__ import print_function
+import os
+import sys
+
+from common import best_of, create_benchmark_app, fill_synthetic_data
+
+from cpucoolerchart.extensions import cache, db
+from cpucoolerchart.models import Measurement
+
+
+def orm_as_dict():
+    rows = [obj.as_dict() for obj in Measurement.query.all()]
+    db.session.expunge_all()
+    return rows
+
+
+def main(*makers_list):
+    print('{0:>8}{1:>18}{2:>18}{3:>18}'.format(
+        'rows', 'ORM (us/row)', 'tuples (us/row)', 'view (us/row)'))
+    for makers in makers_list or (6, 60):
+        app, path = create_benchmark_app()
+        try:
+            with app.app_context():
+                n = fill_synthetic_data(makers=makers)['Measurement']
+                client = app.test_client()
+
+                def render():
+                    cache.delete('snapshot/1/measurements')
+                    client.get('/measurements')
+
+                results = [best_of(func, repeat=3, number=3) * 1000 / n
+                           for func in (orm_as_dict,
+                                        Measurement.query.all_as_dict,
+                                        render)]
+                print('{0:>8}{1:>18.2f}{2:>18.2f}{3:>18.2f}'.format(
+                    n, *results))
+        finally:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -28,8 +28,12 @@ if not PY2:
     itervalues = lambda d: iter(d.values())
     iteritems = lambda d: iter(d.items())
 
-    import urllib
-    import http
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+    import http.client
+    import http.server
+    import socketserver
 else:
     text_type = unicode
     string_types = (str, unicode)
@@ -60,16 +64,23 @@ else:
     urllib.parse = types.ModuleType('urllib.parse')
     urllib.parse.urlencode = urllib_old.urlencode
     urllib.parse.urlparse = urlparse.urlparse
+    urllib.parse.parse_qs = urlparse.parse_qs
     urllib.request = types.ModuleType('urllib.request')
     urllib.request.urlopen = urllib2.urlopen
+    urllib.request.Request = urllib2.Request
     urllib.request.install_opener = urllib2.install_opener
     urllib.request.build_opener = urllib2.build_opener
     urllib.request.HTTPHandler = urllib2.HTTPHandler
     urllib.response = types.ModuleType('urllib.response')
     urllib.response.addinfourl = urllib2.addinfourl
+    urllib.error = types.ModuleType('urllib.error')
+    urllib.error.HTTPError = urllib2.HTTPError
     import httplib
+    import BaseHTTPServer
+    import SocketServer as socketserver
     http = types.ModuleType('http')
     http.client = httplib
+    http.server = BaseHTTPServer
 
 
 if PY26:
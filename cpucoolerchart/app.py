@@ -11,7 +11,9 @@ import os
 from flask import Flask
 
 from ._compat import string_types, iteritems
+from .cache import init_local_cache
 from .extensions import db, cache, redis
+from .snapshots import LOCAL_CACHE_PREFIXES
 from .views import views
 
 
@@ -30,10 +32,23 @@ DEFAULT_CONFIG = dict(
     CACHE_DIR='{INSTANCE_PATH}/cache',
     CACHE_DEFAULT_TIMEOUT=3600 * 3,
     CACHE_KEY_PREFIX='cpucoolerchart:',
+    SNAPSHOT_TIMEOUT=86400 * 7,
+    SNAPSHOT_SOFT_TIMEOUT=86400 * 3,
+    SNAPSHOT_QUERY_TIMEOUT=600,
+    SNAPSHOT_ENCODINGS=('gzip',),
+    SNAPSHOT_LOCK_TIMEOUT=60,
+    SNAPSHOT_LOCK_WAIT=10,
+    LOCAL_CACHE_SIZE=256,
+    LOCAL_CACHE_TIMEOUT=60,
     ACCESS_CONTROL_ALLOW_ORIGIN='*',
     UPDATE_INTERVAL=86400,
+    CHANGES_RETENTION=30,
+    UPDATE_SWAP_DATABASE=False,
+    CRAWLER_FETCH_CONCURRENCY=4,
     DANAWA_API_KEY_PRODUCT_INFO=None,
     DANAWA_API_KEY_SEARCH=None,
+    DANAWA_FETCH_CONCURRENCY=4,
+    DANAWA_REQUEST_TIMEOUT=10,
     USE_QUEUE=False,
     RQ_URL=None,
     START_WORKER_NODE=None,
@@ -88,6 +103,7 @@ def create_app(config=None):
 
     db.init_app(app)
     cache.init_app(app)
+    init_local_cache(app, cache, LOCAL_CACHE_PREFIXES)
     if app.config.get('USE_QUEUE'):
         redis.init_app(app)
 
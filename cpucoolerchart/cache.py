@@ -6,10 +6,177 @@
 
 """
 
+import logging
+import os
+import threading
+import time
 import zlib
 
 import redis
-from werkzeug.contrib.cache import RedisCache
+from werkzeug.contrib.cache import BaseCache, RedisCache
+try:
+    import lz4.block as lz4
+except ImportError:
+    try:
+        # lz4 < 0.10 has the same functions at the top level.
+        import lz4
+    except ImportError:
+        lz4 = None
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+from ._compat import OrderedDict, string_types, to_native
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Values whose serialized form is shorter than this number of bytes are
+#: stored without compression by default.
+COMPRESSION_THRESHOLD = 256
+
+
+class Codec(object):
+    """A compression codec of :class:`CompressedRedisCache`. Compressed values
+    are stored with :attr:`header` in front of them, so that they can be
+    decompressed with the right codec. *level* is the compression level, or
+    ``None`` for the default of the codec. Subclasses override
+    :meth:`compress` and :meth:`decompress`, which use zlib by default.
+
+    """
+
+    #: The name used in ``CACHE_COMPRESSION``.
+    name = None
+
+    #: A byte identifying the codec in stored values. It must not be ``!``,
+    #: ``x``, ``-`` or a digit, which may start other values.
+    header = None
+
+    #: ``False`` if the library implementing the codec is not installed.
+    available = True
+
+    def __init__(self, level=None):
+        self.level = level
+
+    def compress(self, data):
+        if self.level is None:
+            return zlib.compress(data)
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class ZlibCodec(Codec):
+    """Compresses values with zlib. It is always available."""
+
+    name = 'zlib'
+    header = b'\x01'
+
+
+class LZ4Codec(Codec):
+    """Compresses values with LZ4__, which is much faster than zlib but
+    compresses less. Requires the lz4 package. *level* is ignored.
+
+    __ https://pypi.python.org/pypi/lz4
+
+    """
+
+    name = 'lz4'
+    header = b'\x02'
+    available = lz4 is not None
+
+    def compress(self, data):
+        return lz4.compress(data)
+
+    def decompress(self, data):
+        return lz4.decompress(data)
+
+
+class ZstdCodec(Codec):
+    """Compresses values with Zstandard__, which is faster than zlib and
+    compresses better. Requires the zstandard package. If *dictionary*, the
+    bytes of a dictionary made by :func:`train_zstd_dictionary`, is given,
+    it is used to compress small values much better. Values compressed with
+    a dictionary can only be decompressed with the same dictionary.
+
+    __ https://pypi.python.org/pypi/zstandard
+
+    """
+
+    name = 'zstd'
+    header = b'\x03'
+    available = zstd is not None
+
+    def __init__(self, level=None, dictionary=None):
+        super(ZstdCodec, self).__init__(level)
+        self.dictionary = None
+        if dictionary is not None:
+            self.dictionary = zstd.ZstdCompressionDict(dictionary)
+        # Compressors and decompressors must not be shared between threads.
+        self._local = threading.local()
+
+    def compress(self, data):
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            kwargs = {'write_content_size': True}
+            if self.level is not None:
+                kwargs['level'] = self.level
+            if self.dictionary is not None:
+                kwargs['dict_data'] = self.dictionary
+            compressor = zstd.ZstdCompressor(**kwargs)
+            self._local.compressor = compressor
+        return compressor.compress(data)
+
+    def decompress(self, data):
+        decompressor = getattr(self._local, 'decompressor', None)
+        if decompressor is None:
+            kwargs = {}
+            if self.dictionary is not None:
+                kwargs['dict_data'] = self.dictionary
+            decompressor = zstd.ZstdDecompressor(**kwargs)
+            self._local.decompressor = decompressor
+        return decompressor.decompress(data)
+
+
+#: Codec classes keyed by name.
+CODECS = OrderedDict((codec.name, codec) for codec in
+                     (ZlibCodec, LZ4Codec, ZstdCodec))
+
+
+def train_zstd_dictionary(samples, size=16384):
+    """Returns the bytes of a Zstandard dictionary of *size* bytes trained on
+    *samples*, a list of bytes resembling the values to be cached, for
+    :class:`ZstdCodec`.
+
+    """
+    if zstd is None:
+        raise RuntimeError('zstandard is not installed')
+    return zstd.train_dictionary(size, samples).as_bytes()
+
+
+class CodecStats(object):
+    """Counters of a codec of :class:`CompressedRedisCache`. Sizes are in
+    bytes and times are in seconds.
+
+    """
+
+    __slots__ = ('dumps', 'loads', 'bytes_in', 'bytes_out', 'dump_time',
+                 'load_time')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return 'CodecStats({0})'.format(', '.join(
+            '{0}={1!r}'.format(name, getattr(self, name))
+            for name in self.__slots__))
 
 
 class CompressedRedisCache(RedisCache):
@@ -17,28 +184,130 @@ class CompressedRedisCache(RedisCache):
     Values are transparently compressed and decompressed when storing and
     fetching.
 
+    Values are compressed with *codec*, the name of a codec in
+    :data:`CODECS` or ``None`` to disable compression, at *level*. If the
+    codec is not available, zlib is used instead. Values whose serialized
+    form is shorter than *threshold* bytes, and values that compression
+    doesn't make smaller, are stored as they are, so that small values such
+    as flags cost no compression. Any available codec can decompress values
+    regardless of *codec*, so it can be changed without clearing the cache.
+    *dictionary* is passed to :class:`ZstdCodec`.
+
+    Sizes and times are counted for each codec, and for values stored as
+    they are under ``"raw"``, in :attr:`stats`. If *stats_interval* is not
+    zero, the counters are logged every that many seconds.
+
     To use this cache, set *CACHE_TYPE* to
     ``"cpucoolerchart.cache.compressedredis"`` when configuring the app.
 
     """
 
     def __init__(self, *args, **kwargs):
+        codec = kwargs.pop('codec', 'zlib')
+        level = kwargs.pop('level', None)
+        self.threshold = kwargs.pop('threshold', COMPRESSION_THRESHOLD)
+        dictionary = kwargs.pop('dictionary', None)
+        self.stats_interval = kwargs.pop('stats_interval', 0)
         super(CompressedRedisCache, self).__init__(*args, **kwargs)
+        self.decoders = {}
+        for cls in CODECS.values():
+            if not cls.available:
+                continue
+            if cls is ZstdCodec:
+                instance = cls(level, dictionary)
+            else:
+                instance = cls(level)
+            self.decoders[cls.header] = instance
+        if codec is not None and codec not in CODECS:
+            raise ValueError('unknown codec: {0}'.format(codec))
+        if codec is not None and not CODECS[codec].available:
+            logger.warning('%s is not installed; using zlib instead', codec)
+            codec = 'zlib'
+        self.codec = None
+        if codec is not None:
+            self.codec = self.decoders[CODECS[codec].header]
+        #: :class:`CodecStats` keyed by codec name
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self._stats_logged_at = time.time()
 
     def dump_object(self, value):
         serialized_str = RedisCache.dump_object(self, value)
-        try:
-            return zlib.compress(serialized_str)
-        except zlib.error:
+        if self.codec is None or len(serialized_str) < self.threshold:
+            self._count('raw', 'dump', serialized_str, serialized_str, 0)
             return serialized_str
+        start = time.time()
+        try:
+            compressed = self.codec.header + self.codec.compress(
+                serialized_str)
+        except Exception:
+            logger.exception('Could not compress a value with %s',
+                             self.codec.name)
+            compressed = serialized_str
+        elapsed = time.time() - start
+        if len(compressed) >= len(serialized_str):
+            compressed = serialized_str
+        self._count(self.codec.name, 'dump', serialized_str, compressed,
+                    elapsed)
+        return compressed
 
     def load_object(self, value):
-        try:
-            serialized_str = zlib.decompress(value)
-        except (zlib.error, TypeError):
+        if value is None:
+            return None
+        header = value[:1]
+        codec = self.decoders.get(header)
+        if codec is not None:
+            start = time.time()
+            try:
+                serialized_str = codec.decompress(value[1:])
+            except Exception:
+                logger.exception('Could not decompress a value with %s',
+                                 codec.name)
+                return None
+            self._count(codec.name, 'load', serialized_str, value,
+                        time.time() - start)
+        elif header in HEADERS:
+            # Compressed with a codec that is not installed here
+            return None
+        elif header == b'x':
+            # Compressed with zlib by an older version, without a header
+            try:
+                serialized_str = zlib.decompress(value)
+            except zlib.error:
+                serialized_str = value
+        else:
             serialized_str = value
+            self._count('raw', 'load', value, value, 0)
         return RedisCache.load_object(self, serialized_str)
 
+    def _count(self, name, op, serialized_str, stored, elapsed):
+        with self._stats_lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = CodecStats()
+            if op == 'dump':
+                stats.dumps += 1
+                stats.dump_time += elapsed
+            else:
+                stats.loads += 1
+                stats.load_time += elapsed
+            stats.bytes_in += len(serialized_str)
+            stats.bytes_out += len(stored)
+            now = time.time()
+            if not self.stats_interval or \
+                    now - self._stats_logged_at < self.stats_interval:
+                return
+            self._stats_logged_at = now
+            snapshot = sorted((name, stats.as_dict())
+                              for name, stats in self.stats.items())
+        for name, values in snapshot:
+            logger.info('cache codec %s: %s', name, ', '.join(
+                '{0}={1}'.format(k, v) for k, v in sorted(values.items())))
+
+
+#: Headers of all codecs, including those that are not available.
+HEADERS = frozenset(codec.header for codec in CODECS.values())
+
 
 def compressedredis(app, config, args, kwargs):
     """Returns a :class:`CompressedRedisCache`. Compatible with Flask-Cache.
@@ -63,4 +332,186 @@ def compressedredis(app, config, args, kwargs):
     if redis_url:
         kwargs['host'] = redis.from_url(redis_url, db=kwargs.pop('db', None))
 
+    kwargs['codec'] = config.get('CACHE_COMPRESSION', 'zlib')
+    kwargs['level'] = config.get('CACHE_COMPRESSION_LEVEL')
+    kwargs['threshold'] = config.get('CACHE_COMPRESSION_THRESHOLD',
+                                     COMPRESSION_THRESHOLD)
+    kwargs['stats_interval'] = config.get('CACHE_COMPRESSION_STATS_INTERVAL',
+                                          0)
+    dictionary_path = config.get('CACHE_COMPRESSION_DICTIONARY')
+    if dictionary_path:
+        with open(dictionary_path, 'rb') as f:
+            kwargs['dictionary'] = f.read()
+
     return CompressedRedisCache(*args, **kwargs)
+
+
+class LocalCache(BaseCache):
+    """An in-process, size-bounded LRU cache in front of *backend*, another
+    :class:`~werkzeug.contrib.cache.BaseCache`. Only the values of keys that
+    start with one of *prefixes* are kept locally, up to *maxsize* of them
+    for at most *timeout* seconds; other keys go straight to *backend*.
+
+    Setting or deleting a local key drops the local copy. If *redis*, a
+    Redis client, is given, the key is also published on *channel*, and
+    every process listening on it drops its own copy, so that the values
+    stay consistent across workers and nodes. Without it, a stale copy in
+    another process is kept until it times out. Each process starts
+    listening when it first reads a local key.
+
+    """
+
+    def __init__(self, backend, maxsize=256, prefixes=(), timeout=60,
+                 redis=None, channel='invalidate'):
+        BaseCache.__init__(self, default_timeout=backend.default_timeout)
+        self.backend = backend
+        self.maxsize = maxsize
+        self.prefixes = tuple(prefixes)
+        self.timeout = timeout
+        self.redis = redis
+        self.channel = channel
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._listener_pid = None
+
+    def is_local(self, key):
+        """Returns ``True`` if the value of *key* is kept locally."""
+        return isinstance(key, string_types) and key.startswith(self.prefixes)
+
+    def get(self, key):
+        if not self.is_local(key):
+            return self.backend.get(key)
+        self._ensure_listening()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > now:
+                self._entries[key] = entry
+                return entry[1]
+            generation = self._generation
+        value = self.backend.get(key)
+        if value is not None:
+            with self._lock:
+                # Don't keep a value that may have been invalidated while it
+                # was being fetched.
+                if generation == self._generation:
+                    self._entries[key] = (now + self.timeout, value)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+        return value
+
+    def set(self, key, value, timeout=None):
+        rv = self.backend.set(key, value, timeout)
+        self._invalidate(key)
+        return rv
+
+    def add(self, key, value, timeout=None):
+        rv = self.backend.add(key, value, timeout)
+        self._invalidate(key)
+        return rv
+
+    def delete(self, key):
+        rv = self.backend.delete(key)
+        self._invalidate(key)
+        return rv
+
+    def has(self, key):
+        return self.backend.has(key)
+
+    def inc(self, key, delta=1):
+        rv = self.backend.inc(key, delta)
+        self._invalidate(key)
+        return rv
+
+    def dec(self, key, delta=1):
+        rv = self.backend.dec(key, delta)
+        self._invalidate(key)
+        return rv
+
+    def clear(self):
+        rv = self.backend.clear()
+        self._drop(None)
+        self._publish('clear')
+        return rv
+
+    def _invalidate(self, key):
+        if self.is_local(key):
+            self._drop(key)
+            self._publish('del:' + key)
+
+    def _drop(self, key):
+        """Drops the local copy of *key*, or all of them if it is ``None``.
+        """
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def _publish(self, message):
+        if self.redis is None:
+            return
+        try:
+            self.redis.publish(self.channel, message)
+        except redis.RedisError:
+            logger.exception('Could not publish cache invalidation')
+
+    def _ensure_listening(self):
+        if self.redis is None or self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            # A forked process doesn't inherit the thread of its parent.
+            self._listener_pid = os.getpid()
+            self._entries.clear()
+        thread = threading.Thread(target=self._listen)
+        thread.daemon = True
+        thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.handle_message(message['data'])
+            except redis.RedisError:
+                logger.exception('Lost the cache invalidation channel')
+            # Invalidations may have been missed while disconnected.
+            self._drop(None)
+            time.sleep(1)
+
+    def handle_message(self, message):
+        """Drops local copies according to *message* received on
+        :attr:`channel`.
+
+        """
+        message = to_native(message, 'utf-8')
+        if message == 'clear':
+            self._drop(None)
+        elif message.startswith('del:'):
+            self._drop(message[4:])
+
+
+def init_local_cache(app, cache, prefixes):
+    """Puts a :class:`LocalCache` in front of the backend of *cache*, a
+    Flask-Cache instance, for *app* if ``LOCAL_CACHE_SIZE`` is not zero.
+    Invalidations are broadcast if the backend is a Redis cache.
+
+    """
+    size = app.config['LOCAL_CACHE_SIZE']
+    if not size:
+        return
+    backend = app.extensions['cache'][cache]
+    client = None
+    if isinstance(backend, RedisCache):
+        client = backend._client
+    channel = (app.config.get('CACHE_KEY_PREFIX') or '') + 'invalidate'
+    app.extensions['cache'][cache] = LocalCache(
+        backend, maxsize=size, prefixes=prefixes,
+        timeout=app.config['LOCAL_CACHE_TIMEOUT'], redis=client,
+        channel=channel)
@@ -0,0 +1,157 @@
+"""
+    cpucoolerchart.changes
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Implements changesets. Each update records which rows it inserted,
+    updated or deleted, so that clients keeping a copy of the data can fetch
+    only the rows changed since the version they have.
+
+"""
+
+import hashlib
+
+from flask import current_app
+from sqlalchemy import bindparam, func
+
+from ._compat import iteritems, to_bytes
+from .extensions import db
+from .models import (Maker, Heatsink, FanConfig, Measurement, DataVersion,
+                     Changeset, RowChange, RowDigest)
+
+
+__all__ = ['CHANGE_TABLES', 'record_changes', 'compact_changesets',
+           'get_changes']
+
+
+#: Models whose changes are recorded, keyed by the name used in the *changes*
+#: property of :func:`get_changes`.
+CHANGE_TABLES = [
+    ('makers', Maker),
+    ('heatsinks', Heatsink),
+    ('fan_configs', FanConfig),
+    ('measurements', Measurement),
+]
+
+#: The maximum number of values bound to a single ``IN`` clause.
+CHUNK_SIZE = 500
+
+
+def row_digests(model):
+    """Returns a mapping from the id of each row of *model* to the SHA-1 hex
+    digest of its values.
+
+    """
+    digests = {}
+    for row in db.session.query(*model.__table__.columns):
+        data = to_bytes(repr(tuple(row)), 'utf-8')
+        digests[row[0]] = hashlib.sha1(data).hexdigest()
+    return digests
+
+
+def record_changes(version):
+    """Records the rows changed since the previous version as the changeset
+    of *version*, a :class:`~cpucoolerchart.models.DataVersion` that is not
+    committed yet. Changes are found by comparing rows with the digests saved
+    at the previous version, so changes committed by earlier failed updates
+    are included as well.
+
+    """
+    db.session.flush()
+    db.session.add(Changeset(id=version.id))
+    db.session.flush()
+    changes = []
+    for name, model in CHANGE_TABLES:
+        table_name = model.__table__.name
+        current = row_digests(model)
+        saved = dict(db.session.query(RowDigest.row_id, RowDigest.digest)
+                     .filter_by(table_name=table_name))
+        inserted = [row_id for row_id in current if row_id not in saved]
+        updated = [row_id for row_id, digest in iteritems(current)
+                   if row_id in saved and saved[row_id] != digest]
+        deleted = [row_id for row_id in saved if row_id not in current]
+        for action, row_ids in (('insert', inserted), ('update', updated),
+                                ('delete', deleted)):
+            changes.extend({'version': version.id, 'table_name': table_name,
+                            'row_id': row_id, 'action': action}
+                           for row_id in row_ids)
+        _save_digests(table_name, current, inserted, updated, deleted)
+    if changes:
+        db.session.execute(RowChange.__table__.insert(), changes)
+    compact_changesets(version.id)
+    return len(changes)
+
+
+def _save_digests(table_name, current, inserted, updated, deleted):
+    table = RowDigest.__table__
+    if inserted:
+        db.session.execute(table.insert(), [
+            {'table_name': table_name, 'row_id': row_id,
+             'digest': current[row_id]} for row_id in inserted])
+    if updated:
+        stmt = table.update().where(
+            (table.c.table_name == table_name) &
+            (table.c.row_id == bindparam('_row_id'))).values(
+            digest=bindparam('digest'))
+        db.session.execute(stmt, [{'_row_id': row_id,
+                                   'digest': current[row_id]}
+                                  for row_id in updated])
+    for i in range(0, len(deleted), CHUNK_SIZE):
+        db.session.execute(table.delete().where(
+            (table.c.table_name == table_name) &
+            table.c.row_id.in_(deleted[i:i + CHUNK_SIZE])))
+
+
+def compact_changesets(version):
+    """Deletes changesets older than ``CHANGES_RETENTION`` versions before
+    *version*. Clients having a version older than that have to download all
+    data again.
+
+    """
+    cutoff = version - current_app.config['CHANGES_RETENTION']
+    if cutoff <= 0:
+        return
+    RowChange.query.filter(RowChange.version <= cutoff).delete(
+        synchronize_session=False)
+    Changeset.query.filter(Changeset.id <= cutoff).delete(
+        synchronize_session=False)
+
+
+def get_changes(since, version=None):
+    """Returns the changes from the version *since* to *version*, or the
+    latest version if it is ``None``, as a mapping with the following keys:
+
+    - *version*: the version number of the changes.
+    - *resync*: ``True`` if the changes cannot be computed because changesets
+      of some versions after *since* are not available, e.g. they have been
+      compacted. In this case there is no *changes* key.
+    - *changes*: a mapping from each name in :data:`CHANGE_TABLES` to a
+      mapping with two keys, *upserted*, a list of the current values of rows
+      inserted or updated since *since*, and *deleted*, a list of the ids of
+      rows deleted since *since*.
+
+    Changesets are merged, so a row appears only once with its latest
+    values. A row inserted and then deleted after *since* appears in
+    *deleted*.
+
+    """
+    if version is None:
+        version = db.session.query(func.max(DataVersion.id)).scalar() or 0
+    # Version numbers can have gaps, e.g. ids of rolled back versions are
+    # not reused by some databases, so versions are counted.
+    versions = DataVersion.query.filter(DataVersion.id > since,
+                                        DataVersion.id <= version).count()
+    recorded = Changeset.query.filter(Changeset.id > since,
+                                      Changeset.id <= version).count()
+    if since > version or recorded != versions:
+        return {'version': version, 'resync': True}
+    changes = {}
+    for name, model in CHANGE_TABLES:
+        touched = db.session.query(RowChange.row_id).filter(
+            RowChange.version > since, RowChange.version <= version,
+            RowChange.table_name == model.__table__.name).distinct()
+        upserted = model.query.filter(model.id.in_(touched)).all_as_dict()
+        existing = set(row['id'] for row in upserted)
+        deleted = sorted(row_id for row_id, in touched
+                         if row_id not in existing)
+        changes[name] = {'upserted': upserted, 'deleted': deleted}
+    return {'version': version, 'resync': False, 'changes': changes}
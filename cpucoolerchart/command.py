@@ -25,11 +25,13 @@
     .. autofunction:: resetdb
     .. autofunction:: clearcache
     .. autofunction:: export
+    .. autofunction:: traindict
     .. autofunction:: danawa
 
 """
 
 from __future__ import print_function
+import io
 import sys
 
 from flask import current_app
@@ -37,10 +39,13 @@ from flask.ext.script import Manager, prompt_bool
 import rq
 
 from .app import create_app
-from .crawler import update_data, print_danawa_results
+from .cache import train_zstd_dictionary
+from .crawler import (update_data, print_danawa_results, get_page_html,
+                      iter_measurement_targets)
 from .extensions import db, cache, redis, update_queue
 from .models import Maker, Heatsink, FanConfig, Measurement
-from .views import export_data
+from .scoring import get_scores
+from .views import iter_export_data
 
 
 #: The command manager
@@ -123,14 +128,59 @@ def clearcache():
 
 
 @manager.command
-def export(delim=','):
+def export(delim=',', output=None, scores=False):
     """Prints all data in a comma-separated format. Use --delim to change the
-    delimeter to other than a comma.
+    delimeter to other than a comma. Use --output to write the data to a file
+    instead. Use --scores to append the metrics computed by
+    :mod:`cpucoolerchart.scoring`, which requires NumPy. Rows are written as
+    they are read from the database.
 
     """
     if delim == '\\t':
         delim = '\t'
-    print(export_data(delim))
+    arrays = None
+    if scores:
+        arrays = get_scores()
+        if arrays is None:
+            print('numpy is not installed', file=sys.stderr)
+            return
+    chunks = iter_export_data(delim, scores=arrays)
+    if output is None:
+        _write_lines(sys.stdout, chunks)
+    else:
+        with io.open(output, 'w', encoding='utf-8') as f:
+            _write_lines(f, chunks)
+
+
+def _write_lines(f, chunks):
+    for chunk in chunks:
+        f.write(chunk)
+    f.write(u'\n')
+
+
+@manager.command
+def traindict(output, size=16384):
+    """Trains a Zstandard dictionary of *size* bytes on the chart pages of
+    Coolenjoy and writes it to *output*. Set
+    ``CACHE_COMPRESSION_DICTIONARY`` to the path of the file to compress
+    cached values with it. Requires zstandard__.
+
+    __ https://pypi.python.org/pypi/zstandard
+
+    """
+    samples = []
+    for noise, power in iter_measurement_targets():
+        html = get_page_html(noise, power)
+        if not isinstance(html, bytes):
+            html = html.encode('utf-8')
+        samples.extend(html[i:i + 4096] for i in range(0, len(html), 4096))
+    try:
+        dictionary = train_zstd_dictionary(samples, size)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return
+    with io.open(output, 'wb') as f:
+        f.write(dictionary)
 
 
 @manager.command
@@ -10,21 +10,33 @@
 from __future__ import print_function
 import base64
 from datetime import datetime
-import itertools
+import hashlib
 import json
 import logging
+from multiprocessing.pool import ThreadPool
+import os
 import re
+import shutil
+import socket
+import sqlite3
+import threading
+import time
 
 from flask import current_app
 import lxml.etree
 import lxml.html
-from sqlalchemy import func
+from sqlalchemy import bindparam, func
 
-from ._compat import OrderedDict, iteritems, urllib, to_bytes
+from ._compat import (OrderedDict, iteritems, itervalues, urllib, http,
+                      to_bytes)
+from .changes import record_changes
 from .crawler_data import (MAKER_FIX, MODEL_FIX, INCONSISTENCY_FIX,
                            DANAWA_ID_MAPPING)
 from .extensions import db, cache
-from .models import Maker, Heatsink, FanConfig, Measurement
+from .models import (Maker, Heatsink, FanConfig, Measurement, SourcePage,
+                     DataVersion)
+from .snapshots import (publish_data_version, set_data_unpublished,
+                        unset_data_unpublished)
 
 
 __all__ = ['NOISE_MAX', 'NOISE_LEVELS', 'CPU_POWER', 'ORDER_BY',
@@ -41,6 +53,13 @@ NOISE_LEVELS = [35, 40, 45, NOISE_MAX]
 #: List of CPU power consumptions in watt for which the measurements are taken
 CPU_POWER = [62, 92, 150, 200]
 
+#: URL of the Danawa product info API
+DANAWA_PRODUCT_INFO_URL = 'http://api.danawa.com/api/main/product/info'
+
+#: Number of update intervals for which a cached response is kept to be
+#: revalidated after it gets stale
+VALIDATOR_LIFETIME = 7
+
 #: Default sorting order for measurement data
 ORDER_BY = ('maker', 'model', 'fan_size', 'fan_thickness', 'fan_count',
             'noise', 'power', 'noise_actual_min')
@@ -63,6 +82,19 @@ DEPENDENCIES = {
 }
 
 
+#: Columns of :class:`~cpucoolerchart.models.Heatsink` that are determined by
+#: measurement data
+HEATSINK_COLUMNS = ('width', 'depth', 'height', 'heatsink_type', 'weight')
+
+#: Columns of :class:`~cpucoolerchart.models.Measurement` that are determined
+#: by measurement data other than keys
+MEASUREMENT_COLUMNS = ('noise_actual_min', 'noise_actual_max', 'rpm_min',
+                       'rpm_max', 'cpu_temp_delta', 'power_temp_delta')
+
+#: Maximum number of bound parameters in a single ``IN`` clause
+BULK_CHUNK_SIZE = 500
+
+
 class ParseError(Exception):
     """Raised when a returned HTML page from Coolenjoy is not in a expected
     format and cannot be parsed.
@@ -125,20 +157,152 @@ def heatsinks_with_maker_names():
         Maker, Heatsink.maker_id == Maker.id)
 
 
-def get_cached_response_text(url):
+class ConnectionPool(object):
+    """Thread-safe pool of persistent HTTP connections. A connection is
+    returned to the pool after each request unless the server asked to close
+    it, so subsequent requests to the same host reuse it. At most *maxsize*
+    idle connections are kept per host. *timeout* is the socket timeout in
+    seconds for each connection.
+
+    """
+
+    def __init__(self, timeout=None, maxsize=4):
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _get_connection(self, scheme, netloc):
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        if scheme == 'https':
+            conn_class = http.client.HTTPSConnection
+        else:
+            conn_class = http.client.HTTPConnection
+        return conn_class(netloc, timeout=self.timeout), False
+
+    def _put_connection(self, scheme, netloc, conn):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, url, headers=None):
+        """Sends a GET request to *url* and returns a tuple of the status
+        code, a mapping of the response headers with lowercased names, and
+        the response body.
+
+        """
+        parts = urllib.parse.urlparse(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        while True:
+            conn, reused = self._get_connection(parts.scheme, parts.netloc)
+            try:
+                conn.request('GET', path, headers=headers or {})
+                resp = conn.getresponse()
+                body = resp.read()
+            except socket.timeout:
+                conn.close()
+                raise
+            except (http.client.HTTPException, socket.error):
+                conn.close()
+                if reused:
+                    # The server may have closed an idle keep-alive
+                    # connection. Try again with another one.
+                    continue
+                raise
+            break
+        if resp.will_close:
+            conn.close()
+        else:
+            self._put_connection(parts.scheme, parts.netloc, conn)
+        headers = dict((k.lower(), v) for k, v in resp.getheaders())
+        return resp.status, headers, body
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+def request_url(url, headers=None, pool=None):
+    """Sends a GET request to *url* and returns a tuple of the status code, a
+    mapping of the response headers with lowercased names, and the response
+    body. If *pool* is given, a :class:`ConnectionPool` is used to make the
+    request. Responses other than 200 and 304 raise :exc:`IOError`.
+
+    """
+    if pool is not None:
+        status, resp_headers, body = pool.request(url, headers)
+    else:
+        req = urllib.request.Request(url, headers=headers or {})
+        try:
+            resp = urllib.request.urlopen(req)
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                raise
+            resp = e
+        try:
+            status = resp.getcode()
+            resp_headers = dict((k.lower(), v) for k, v
+                                in resp.info().items())
+            body = resp.read() if status != 304 else b''
+        finally:
+            resp.close()
+    if status not in (200, 304):
+        raise IOError('HTTP {0} error for {1}'.format(status, url))
+    return status, resp_headers, body
+
+
+def get_cached_response_text(url, pool=None):
     """Returns a response body fetched from the specified URL. The return value
     is cached up to ``UPDATE_INTERVAL`` minus a small fixed amount of time.
+    If *pool* is given, a :class:`ConnectionPool` is used to make a request.
+
+    The ``ETag`` and ``Last-Modified`` response headers are stored with the
+    cached body. When the cached body gets old, the request is sent with
+    ``If-None-Match`` and ``If-Modified-Since`` and the cached body is reused
+    if the server responds with 304 Not Modified.
 
     """
     key = base64.b64encode(to_bytes(url), b'-_')
-    text = cache.get(key)
-    if text is None:
-        resp = urllib.request.urlopen(url)
-        text = resp.read()
-        resp.close()
-        # Prevent partial refreshing by setting the timeout a bit shorter.
-        cache.set(key, text,
-                  timeout=current_app.config['UPDATE_INTERVAL'] - 600)
+    entry = cache.get(key)
+    now = time.time()
+    if entry is not None and not isinstance(entry, tuple):
+        return entry  # Cached without validators by an older version
+    if entry is not None and entry[3] > now:
+        return entry[0]
+    headers = {}
+    if entry is not None:
+        if entry[1]:
+            headers['If-None-Match'] = entry[1]
+        if entry[2]:
+            headers['If-Modified-Since'] = entry[2]
+    status, resp_headers, text = request_url(url, headers, pool)
+    if status == 304 and entry is not None:
+        _log('debug', u'Not modified: %s', url)
+        text = entry[0]
+        etag = resp_headers.get('etag', entry[1])
+        last_modified = resp_headers.get('last-modified', entry[2])
+    elif status == 304:
+        raise IOError('HTTP 304 without a cached body for {0}'.format(url))
+    else:
+        etag = resp_headers.get('etag')
+        last_modified = resp_headers.get('last-modified')
+    interval = current_app.config['UPDATE_INTERVAL']
+    # Prevent partial refreshing by making it stale a bit earlier. The entry
+    # itself is kept longer so that it can be revalidated.
+    cache.set(key, (text, etag, last_modified, now + interval - 600),
+              timeout=interval * VALIDATOR_LIFETIME)
     return text
 
 
@@ -181,7 +345,17 @@ def update_data(force=False):
             _log('info', 'Update is in progress in other process')
         else:
             set_update_running()
-            do_update_data()
+            if current_app.config.get('UPDATE_SWAP_DATABASE'):
+                created = do_update_data_in_staging()
+            else:
+                # Kept set if the update fails halfway, until the next
+                # version is published.
+                set_data_unpublished()
+                created = do_update_data()
+            if created:
+                publish_data_version()
+            else:
+                unset_data_unpublished()
             cache.set('up_to_date', True,
                       timeout=current_app.config['UPDATE_INTERVAL'])
     except Exception:
@@ -194,15 +368,113 @@ def do_update_data():
     """Same as :func:`update_data` but without checking for update conditions.
     Used internally by :func:`update_data`.
 
+    If no page has changed since the last successful update, parsing and
+    synchronization of measurement data are skipped entirely. Otherwise all
+    pages are parsed and synchronized, since a change on one page can change
+    which rows of the other pages pass :func:`ensure_consistency`. Only rows
+    that differ are written either way.
+
+    Returns ``True`` if a new :class:`~cpucoolerchart.models.DataVersion` is
+    created, or ``False`` if the update failed or no row has changed since
+    the current version, in which case the current version is kept so that
+    clients' copies stay valid. Nothing is committed if fetching or parsing
+    fails.
+
     """
-    fix_existing_data()
-    data_list = fetch_measurement_data()
-    if not data_list:
+    pages = fetch_measurement_pages()
+    if not pages:
         _log('warning', 'There was an error during fetching measurement data.')
+        return False
+    digests = page_digests(pages)
+    changed = changed_pages(digests)
+    if changed:
+        data_list = parse_measurement_pages(pages)
+        if not data_list:
+            _log('warning',
+                 'There was an error during fetching measurement data.')
+            return False
+    # Nothing is committed until the pages are fetched and parsed.
+    fix_existing_data()
+    if not changed:
+        _log('info', 'Measurement data is unchanged since the last update; '
+             'skipped parsing and synchronizing')
     else:
+        _log('info', u'Changed pages: %s', sorted(changed))
         update_measurement_data(data_list)
-        update_danawa_data()
-        _log('info', 'Successfully updated data from remote sources')
+        save_page_digests(digests)
+    update_danawa_data()
+    version = DataVersion(created_at=datetime.utcnow())
+    db.session.add(version)
+    if not record_changes(version):
+        db.session.rollback()
+        _log('info', 'Data is unchanged since the last version; '
+             'kept the current version')
+        return False
+    db.session.commit()
+    _log('info', 'Successfully updated data from remote sources')
+    return True
+
+
+def do_update_data_in_staging():
+    """Same as :func:`do_update_data` but the live database is not modified
+    during the update. The SQLite database file is copied to a staging file,
+    the update runs against the copy, and the copy then replaces the live file
+    with an atomic rename. Readers never wait for the update's write lock and
+    see either the old or the new data, not a mix of them.
+
+    The rename is atomic on POSIX systems only. Since connections opened
+    before the swap keep reading the old file, the database should use the
+    default pool, which opens a new connection for each session. If the
+    database is not a file-based SQLite database, it falls back to
+    :func:`do_update_data`. Returns what :func:`do_update_data` returns, and
+    the live file is replaced only if it returns ``True``.
+
+    """
+    from .app import create_app
+
+    url = db.get_engine(current_app).url
+    if url.drivername != 'sqlite' or url.database in (None, '', ':memory:'):
+        _log('warning', 'UPDATE_SWAP_DATABASE requires a file-based SQLite '
+             'database; updating the database in place')
+        set_data_unpublished()
+        return do_update_data()
+    path = os.path.abspath(url.database)
+    staging_path = path + '.staging'
+    if os.path.exists(path):
+        copy_sqlite_database(path, staging_path)
+    config = dict(current_app.config)
+    config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + staging_path
+    staging_app = create_app(config)
+    try:
+        with staging_app.app_context():
+            db.create_all()
+            created = do_update_data()
+            db.session.remove()
+            db.get_engine(staging_app).dispose()
+        if not created:
+            return False
+        set_data_unpublished()
+        os.rename(staging_path, path)
+        db.session.remove()  # Do not keep a connection to the old file
+        _log('info', 'Swapped in the updated database')
+        return True
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+
+def copy_sqlite_database(src, dst):
+    """Copies the SQLite database file *src* to *dst*. A shared lock is held
+    during the copy so that it is not modified in the middle.
+
+    """
+    conn = sqlite3.connect(src, isolation_level=None)
+    try:
+        conn.execute('BEGIN')
+        conn.execute('SELECT count(*) FROM sqlite_master').fetchall()
+        shutil.copyfile(src, dst)
+    finally:
+        conn.close()
 
 
 def fix_existing_data():
@@ -232,38 +504,143 @@ def fetch_measurement_data():
     data list. It contains information about makers, heatsinks, fan configs,
     and measurements.
 
+    Pages are downloaded by up to ``CRAWLER_FETCH_CONCURRENCY`` threads at
+    once. If any of them fails, an empty list is returned.
+
+    """
+    pages = fetch_measurement_pages()
+    if not pages:
+        return []
+    return parse_measurement_pages(pages)
+
+
+def fetch_measurement_pages():
+    """Downloads all Coolenjoy chart pages and returns an ordered mapping from
+    each pair of a noise level and a CPU power consumption to the HTML of the
+    page. Returns ``None`` if any of the pages could not be downloaded.
+
+    """
+    targets = list(iter_measurement_targets())
+    try:
+        htmls = map_concurrently(
+            get_page_html, targets,
+            current_app.config.get('CRAWLER_FETCH_CONCURRENCY', 1))
+    except Exception:
+        _log('warning', 'An error occurred while requesting a page',
+             exc_info=True)
+        return None  # Do not return partially fetched pages
+    return OrderedDict(zip(targets, htmls))
+
+
+def parse_measurement_pages(pages):
+    """Parses pages returned by :func:`fetch_measurement_pages` and returns a
+    inconsistency-free data list, or an empty list if any of the pages could
+    not be parsed.
+
     """
     reset_warnings()
     data_list = []
+    for (noise, power), html in iteritems(pages):
+        try:
+            table = parse_html_table(html)
+            new_data_list = extract_data(table, noise, power)
+        except ParseError:
+            _log('warning', 'An error occurred while parsing a page',
+                 exc_info=True)
+            return []  # Do not return partially fetched data list
+        data_list.extend(new_data_list)
+    data_list.sort(key=dictitemgetter(*ORDER_BY))
+    data_list = ensure_consistency(data_list)
+    return data_list
+
+
+def page_digests(pages):
+    """Returns a mapping from each key of *pages* to the SHA-1 hex digest of
+    its content.
+
+    """
+    return dict((key, hashlib.sha1(to_bytes(html, 'utf-8')).hexdigest())
+                for key, html in iteritems(pages))
+
+
+def changed_pages(digests):
+    """Returns a set of keys in *digests* whose digest is different from the
+    one saved at the last successful update.
+
+    """
+    saved = dict(((page.noise, page.power), page.digest)
+                 for page in SourcePage.query)
+    return set(key for key, digest in iteritems(digests)
+               if saved.get(key) != digest)
+
+
+def save_page_digests(digests):
+    """Saves *digests* so that :func:`changed_pages` compares against them in
+    the next update.
+
+    """
+    pages = dict(((page.noise, page.power), page)
+                 for page in SourcePage.query)
+    for (noise, power), digest in iteritems(digests):
+        page = pages.pop((noise, power), None)
+        if page is None:
+            db.session.add(SourcePage(noise=noise, power=power,
+                                      digest=digest))
+        else:
+            page.update(digest=digest)
+    for page in itervalues(pages):
+        db.session.delete(page)
+    db.session.commit()
+
+
+def iter_measurement_targets():
+    """Returns an iterator that yields each pair of a noise level and a CPU
+    power consumption for which Coolenjoy publishes a chart page.
+
+    """
     for noise in NOISE_LEVELS:
         for power in CPU_POWER:
             if noise != NOISE_MAX and noise <= 40 and power >= 200:
                 continue
-            try:
-                table = get_html_table(noise, power)
-            except Exception:
-                _log('warning', 'An error occurred while requesting a page',
-                     exc_info=True)
-                return []  # Do not return partially fetched data list
-            try:
-                new_data_list = extract_data(table, noise, power)
-            except ParseError:
-                _log('warning', 'An error occurred while parsing a page',
-                     exc_info=True)
-                return []  # Do not return partially fetched data list
-            data_list.extend(new_data_list)
-    data_list.sort(key=dictitemgetter(*ORDER_BY))
-    data_list = ensure_consistency(data_list)
-    return data_list
+            yield noise, power
 
 
-def get_html_table(noise, power):
+def map_concurrently(func, args_list, concurrency):
+    """Calls *func* with each tuple of arguments in *args_list* using at most
+    *concurrency* threads and returns a list of the results in the same order
+    as *args_list*. Each thread runs in the current app context. If any call
+    raises an exception, it is reraised after all calls are finished.
+
+    """
+    args_list = list(args_list)
+    if concurrency <= 1 or len(args_list) <= 1:
+        return [func(*args) for args in args_list]
+    app = current_app._get_current_object()
+
+    def call(args):
+        with app.app_context():
+            return func(*args)
+
+    pool = ThreadPool(min(concurrency, len(args_list)))
+    try:
+        return pool.map(call, args_list, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def get_page_html(noise, power):
+    """Returns the HTML of the Coolenjoy chart page for *noise* and *power*.
+    """
     URL_FMT = ('http://www.coolenjoy.net/cooln_db/cpucooler_charts.php?'
                'dd={noise}&test={power}')
     noise_mapping = {35: 4, 40: 3, 45: 2, NOISE_MAX: 1}
     cpu_mapping = {62: 1, 92: 2, 150: 3, 200: 4}
-    html = get_cached_response_text(URL_FMT.format(noise=noise_mapping[noise],
+    return get_cached_response_text(URL_FMT.format(noise=noise_mapping[noise],
                                                    power=cpu_mapping[power]))
+
+
+def parse_html_table(html):
     doc = lxml.html.fromstring(html)
     table_xpath = doc.xpath('//table[@width="680"][@bordercolorlight="black"]')
     if not table_xpath:
@@ -271,6 +648,10 @@ def get_html_table(noise, power):
     return table_xpath[0]
 
 
+def get_html_table(noise, power):
+    return parse_html_table(get_page_html(noise, power))
+
+
 def extract_data(table, noise, power):
     data_list = []
     for tr in table.xpath('.//tr[@class="tdm"]'):
@@ -441,169 +822,245 @@ def ensure_consistency(data_list):
 
 
 def update_measurement_data(data_list):
-    groups = itertools.groupby(data_list, dictitemgetter('maker'))
-    maker_ids = set()
-    for maker_name, data_sublist in groups:
-        maker_id = update_maker(data_sublist, maker_name)
-        if maker_id is not None:
-            maker_ids.add(maker_id)
-    for maker in Maker.query.filter(~Maker.id.in_(maker_ids)):
-        db.session.delete(maker)
-        _log('debug', u'Deleted old maker: %s', maker.name)
+    """Synchronizes the database with *data_list*.
+
+    Each table is loaded once into a mapping keyed by its natural key, and
+    rows to insert, update and delete are computed from the differences and
+    written with bulk statements in a single transaction.
+
+    """
+    # Desired state, keyed by natural keys in the order of first appearance
+    makers = OrderedDict()
+    heatsinks = OrderedDict()
+    fan_configs = OrderedDict()
+    measurements = OrderedDict()
+    for data in data_list:
+        maker_key = data['maker']
+        heatsink_key = maker_key, data['model']
+        fan_config_key = heatsink_key + (data['fan_size'],
+                                         data['fan_thickness'],
+                                         data['fan_count'])
+        measurement_key = fan_config_key + (data['noise'], data['power'])
+        makers[maker_key] = True
+        heatsinks[heatsink_key] = dict((k, data.get(k))
+                                       for k in HEATSINK_COLUMNS)
+        fan_configs[fan_config_key] = True
+        measurements.setdefault(measurement_key, {}).update(
+            (k, data[k]) for k in MEASUREMENT_COLUMNS if k in data)
+
+    maker_index = _load_index(Maker, ('name',))
+    inserts = [dict(name=key) for key in makers if key not in maker_index]
+    _bulk_insert(Maker, inserts)
+    if inserts:
+        maker_index = _load_index(Maker, ('name',))
+    maker_ids = dict((key, maker_index[key].id) for key in makers)
+
+    heatsink_index = _load_index(Heatsink, ('maker_id', 'name'),
+                                 HEATSINK_COLUMNS)
+    inserts, updates = [], []
+    for (maker_name, model), values in iteritems(heatsinks):
+        row = heatsink_index.get((maker_ids[maker_name], model))
+        if row is None:
+            inserts.append(dict(values, maker_id=maker_ids[maker_name],
+                                name=model))
+        elif any(getattr(row, k) != values[k] for k in HEATSINK_COLUMNS):
+            updates.append(dict(values, _id=row.id))
+    _bulk_insert(Heatsink, inserts)
+    _bulk_update(Heatsink, updates, HEATSINK_COLUMNS)
+    if inserts:
+        heatsink_index = _load_index(Heatsink, ('maker_id', 'name'))
+    heatsink_ids = dict((key, heatsink_index[(maker_ids[key[0]], key[1])].id)
+                        for key in heatsinks)
+
+    fan_config_columns = ('heatsink_id', 'fan_size', 'fan_thickness',
+                          'fan_count')
+    fan_config_index = _load_index(FanConfig, fan_config_columns)
+    inserts = [
+        dict(zip(fan_config_columns, (heatsink_ids[key[:2]],) + key[2:]))
+        for key in fan_configs
+        if (heatsink_ids[key[:2]],) + key[2:] not in fan_config_index]
+    _bulk_insert(FanConfig, inserts)
+    if inserts:
+        fan_config_index = _load_index(FanConfig, fan_config_columns)
+    fan_config_ids = dict(
+        (key, fan_config_index[(heatsink_ids[key[:2]],) + key[2:]].id)
+        for key in fan_configs)
+
+    measurement_index = _load_index(
+        Measurement, ('fan_config_id', 'noise', 'power'), MEASUREMENT_COLUMNS)
+    inserts, updates = [], []
+    for key, values in iteritems(measurements):
+        fan_config_id = fan_config_ids[key[:5]]
+        row = measurement_index.get((fan_config_id,) + key[5:])
+        if row is None:
+            new_values = dict.fromkeys(MEASUREMENT_COLUMNS)
+            new_values.update(values)
+            inserts.append(dict(new_values, fan_config_id=fan_config_id,
+                                noise=key[5], power=key[6]))
+        elif any(getattr(row, k) != v for k, v in iteritems(values)):
+            new_values = dict((k, getattr(row, k))
+                              for k in MEASUREMENT_COLUMNS)
+            new_values.update(values)
+            updates.append(dict(new_values, _id=row.id))
+    _bulk_insert(Measurement, inserts)
+    _bulk_update(Measurement, updates, MEASUREMENT_COLUMNS)
+
+    # Rows of deleted parents are deleted as well, like ORM cascades do.
+    kept_measurement_keys = set((fan_config_ids[key[:5]],) + key[5:]
+                                for key in measurements)
+    kept_fan_config_ids = set(itervalues(fan_config_ids))
+    _bulk_delete(Measurement, [row for key, row in iteritems(measurement_index)
+                               if key not in kept_measurement_keys])
+    _bulk_delete(FanConfig, [row for row in itervalues(fan_config_index)
+                             if row.id not in kept_fan_config_ids])
+    kept_heatsink_ids = set(itervalues(heatsink_ids))
+    _bulk_delete(Heatsink, [row for row in itervalues(heatsink_index)
+                            if row.id not in kept_heatsink_ids])
+    kept_maker_ids = set(itervalues(maker_ids))
+    _bulk_delete(Maker, [row for row in itervalues(maker_index)
+                         if row.id not in kept_maker_ids])
 
     db.session.commit()
 
 
-def update_maker(data_list, maker_name):
-    keys = dict(name=maker_name)
-    data = keys
-    maker = Maker.query.find(**keys)
-    if maker is None:
-        maker = Maker(**data)
-        db.session.add(maker)
-        _log('debug', u'Added new maker: %s', maker.name)
-    else:
-        maker.update(**data)
-
-    groups = itertools.groupby(data_list, dictitemgetter(
-        'model', 'width', 'depth', 'height', 'heatsink_type', 'weight'))
-    heatsink_ids = set()
-    for heatsink_data, data_sublist in groups:
-        heatsink_id = update_heatsink(data_sublist, maker, *heatsink_data)
-        if heatsink_id is not None:
-            heatsink_ids.add(heatsink_id)
-    if maker.id is not None:
-        for heatsink in Heatsink.query.filter(
-                Heatsink.maker_id == maker.id).filter(
-                ~Heatsink.id.in_(heatsink_ids)):
-            db.session.delete(heatsink)
-            _log('debug', u'Deleted old heatsink: %s', heatsink.name)
-
-    return maker.id
-
-
-def update_heatsink(data_list, maker, model_name, width, depth, height,
-                    heatsink_type, weight):
-    keys = dict(name=model_name, maker_id=maker.id)
-    data = dict(name=model_name, maker=maker, width=width, depth=depth,
-                height=height, heatsink_type=heatsink_type, weight=weight)
-    heatsink = Heatsink.query.find(**keys)
-    if heatsink is None:
-        heatsink = Heatsink(**data)
-        db.session.add(heatsink)
-        _log('debug', u'Added new heatsink: %s', heatsink.name)
-    else:
-        heatsink.update(**data)
-
-    groups = itertools.groupby(data_list, dictitemgetter(
-        'fan_size', 'fan_thickness', 'fan_count'))
-    fan_config_ids = set()
-    for fan_config_data, data_sublist in groups:
-        fan_config_id = update_fan_config(data_sublist, heatsink,
-                                          *fan_config_data)
-        if fan_config_id is not None:
-            fan_config_ids.add(fan_config_id)
-    if heatsink.id is not None:
-        for fan_config in FanConfig.query.filter(
-                FanConfig.heatsink_id == heatsink.id).filter(
-                ~FanConfig.id.in_(fan_config_ids)):
-            db.session.delete(fan_config)
-            _log('debug', u'Deleted old fan config (id=%d)', fan_config.id)
-
-    return heatsink.id
-
-
-def update_fan_config(data_list, heatsink, fan_size, fan_thickness, fan_count):
-    keys = dict(fan_size=fan_size, fan_thickness=fan_thickness,
-                fan_count=fan_count, heatsink_id=heatsink.id)
-    data = dict(fan_size=fan_size, fan_thickness=fan_thickness,
-                fan_count=fan_count, heatsink=heatsink)
-    fan_config = FanConfig.query.find(**keys)
-    if fan_config is None:
-        fan_config = FanConfig(**data)
-        db.session.add(fan_config)
-        _log('debug', u'Added new fan config')
-    else:
-        fan_config.update(**data)
+def _load_index(model, key_columns, value_columns=()):
+    """Selects the id and the given columns of all rows of *model* with a
+    single query and returns a mapping from the tuple of *key_columns* (or the
+    single value if there is only one) to each row.
 
-    measurement_ids = set()
-    for data in data_list:
-        measurement_id = update_measurement(fan_config, data)
-        if measurement_id is not None:
-            measurement_ids.add(measurement_id)
-    if fan_config.id is not None:
-        for measurement in Measurement.query.filter(
-                Measurement.fan_config_id == fan_config.id).filter(
-                ~Measurement.id.in_(measurement_ids)):
-            db.session.delete(measurement)
-            _log('debug', u'Deleted old measurement (id=%d)', measurement.id)
-
-    return fan_config.id
-
-
-def update_measurement(fan_config, data):
-    keys = dict((k, data[k]) for k in ('noise', 'power') if k in data)
-    keys['fan_config_id'] = fan_config.id
-    data = dict((k, data[k]) for k in ('noise', 'power', 'noise_actual_min',
-                                       'noise_actual_max', 'rpm_min',
-                                       'rpm_max', 'cpu_temp_delta',
-                                       'power_temp_delta') if k in data)
-    data['fan_config'] = fan_config
-    measurement = Measurement.query.find(**keys)
-    if measurement is None:
-        measurement = Measurement(**data)
-        db.session.add(measurement)
-        _log('debug', u'Added new measurement')
-    else:
-        measurement.update(**data)
+    """
+    columns = [model.__table__.c[name] for name
+               in ('id',) + tuple(key_columns) + tuple(value_columns)]
+    index = {}
+    for row in db.session.query(*columns):
+        key = tuple(getattr(row, name) for name in key_columns)
+        index[key if len(key) > 1 else key[0]] = row
+    return index
+
+
+def _bulk_insert(model, rows):
+    if not rows:
+        return
+    table = model.__table__
+    db.session.execute(table.insert(), rows)
+    for row in rows:
+        if 'name' in row:
+            _log('debug', u'Added new %s: %s', table.name, row['name'])
+    _log('debug', u'Added %d new %s rows', len(rows), table.name)
+
+
+def _bulk_update(model, rows, columns):
+    if not rows:
+        return
+    table = model.__table__
+    stmt = table.update().where(table.c.id == bindparam('_id')).values(
+        dict((name, bindparam(name)) for name in columns))
+    db.session.execute(stmt, rows)
+    _log('debug', u'Updated %d %s rows', len(rows), table.name)
 
-    return measurement.id
+
+def _bulk_delete(model, rows):
+    if not rows:
+        return
+    table = model.__table__
+    ids = [row.id for row in rows]
+    for i in range(0, len(ids), BULK_CHUNK_SIZE):
+        db.session.execute(table.delete().where(
+            table.c.id.in_(ids[i:i + BULK_CHUNK_SIZE])))
+    for row in rows:
+        if 'name' in row.keys():
+            _log('debug', u'Deleted old %s: %s', table.name, row.name)
+    _log('debug', u'Deleted %d old %s rows', len(ids), table.name)
 
 
 def update_danawa_data():
+    """Fetches price data from Danawa for heatsinks with Danawa identifiers
+    and stores them. Up to ``DANAWA_FETCH_CONCURRENCY`` requests are made at
+    the same time over persistent connections. All responses are fetched
+    before the database is touched so that the transaction is kept short.
+
+    """
     if not current_app.config.get('DANAWA_API_KEY_PRODUCT_INFO'):
         _log('warning', 'DANAWA_API_KEY_PRODUCT_INFO not found. '
              'Price data could not be fetched.')
         return
     api_key = current_app.config['DANAWA_API_KEY_PRODUCT_INFO']
+    concurrency = current_app.config.get('DANAWA_FETCH_CONCURRENCY', 1)
+    danawa_ids = {}
+    for heatsink, maker_name in heatsinks_with_maker_names():
+        key = (maker_name + ' ' + heatsink.name).lower()
+        danawa_id = DANAWA_ID_MAPPING.get(key, heatsink.danawa_id)
+        if danawa_id is not None:
+            danawa_ids[heatsink.id] = danawa_id
+    db.session.commit()  # Do not hold a transaction during requests
+
+    targets = sorted(iteritems(danawa_ids))
+    pool = ConnectionPool(
+        timeout=current_app.config.get('DANAWA_REQUEST_TIMEOUT'),
+        maxsize=max(concurrency, 1))
     try:
-        for heatsink, maker_name in heatsinks_with_maker_names():
-            key = (maker_name + ' ' + heatsink.name).lower()
-            if (key in DANAWA_ID_MAPPING and
-                    DANAWA_ID_MAPPING[key] != heatsink.danawa_id):
-                heatsink.danawa_id = DANAWA_ID_MAPPING[key]
-            if heatsink.danawa_id is None:
-                continue
-            url = 'http://api.danawa.com/api/main/product/info'
-            query = OrderedDict([
-                ('key', api_key),
-                ('mediatype', 'json'),
-                ('prodCode', heatsink.danawa_id),
-            ])
-            json_text = get_cached_response_text(url + '?' +
-                                                 urllib.parse.urlencode(query))
-            data = load_danawa_json(json_text)
-            if data is None:
+        results = map_concurrently(
+            fetch_danawa_product_info,
+            [(danawa_id, api_key, pool) for _, danawa_id in targets],
+            concurrency)
+    finally:
+        pool.close()
+
+    try:
+        heatsinks = dict((heatsink.id, heatsink) for heatsink
+                         in Heatsink.query)
+        for (heatsink_id, danawa_id), data in zip(targets, results):
+            heatsink = heatsinks.get(heatsink_id)
+            if heatsink is None:
                 continue
-            min_price = int(data.get('minPrice', 0))
-            if min_price:
-                heatsink.price = min_price
-            shop_count = int(data.get('shopCount', 0))
-            if shop_count:
-                heatsink.shop_count = shop_count
-            input_date = datetime.strptime(data['inputDate'],
-                                           '%Y-%m-%d %H:%M:%S')
-            heatsink.first_seen = input_date
-            for image_info in data['images']['image']:
-                if image_info['name'] == 'large_1':
-                    heatsink.image_url = image_info['url']
-                    break
+            heatsink.update(danawa_id=danawa_id)
+            if data is not None:
+                update_heatsink_price(heatsink, data)
         db.session.commit()
     except Exception:
         _log('exception', 'An error occurred while updating danawa data')
         db.session.rollback()
 
 
+def fetch_danawa_product_info(danawa_id, api_key, pool=None):
+    """Returns product info for *danawa_id* from Danawa as a mapping, or
+    ``None`` if it could not be fetched.
+
+    """
+    query = OrderedDict([
+        ('key', api_key),
+        ('mediatype', 'json'),
+        ('prodCode', danawa_id),
+    ])
+    url = DANAWA_PRODUCT_INFO_URL + '?' + urllib.parse.urlencode(query)
+    try:
+        json_text = get_cached_response_text(url, pool)
+    except Exception:
+        _log('warning', u'An error occurred while requesting product info '
+             u'for %s', danawa_id, exc_info=True)
+        return None
+    return load_danawa_json(json_text)
+
+
+def update_heatsink_price(heatsink, data):
+    """Updates price-related properties of *heatsink* from Danawa product
+    info *data*.
+
+    """
+    min_price = int(data.get('minPrice', 0))
+    if min_price:
+        heatsink.price = min_price
+    shop_count = int(data.get('shopCount', 0))
+    if shop_count:
+        heatsink.shop_count = shop_count
+    input_date = datetime.strptime(data['inputDate'], '%Y-%m-%d %H:%M:%S')
+    heatsink.first_seen = input_date
+    for image_info in data['images']['image']:
+        if image_info['name'] == 'large_1':
+            heatsink.image_url = image_info['url']
+            break
+
+
 def print_danawa_results():
     """Searches Danawa for heatsinks that don't have entries in
     :data:`~cpucoolerchart.crawler_data.DANAWA_ID_MAPPING` and prints results.
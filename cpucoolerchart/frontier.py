@@ -0,0 +1,115 @@
+"""
+    cpucoolerchart.frontier
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Computes the Pareto frontier, or skyline, of measurements over noise,
+    CPU temperature and price: the measurements for which no other one is
+    quieter, cooler and cheaper at the same time. Measurements are joined
+    with their heatsinks and sorted once per data version, and the frontier
+    is found with a single sweep in O(n log n) time instead of comparing
+    every pair.
+
+"""
+
+from bisect import bisect_right
+from collections import namedtuple
+
+from .extensions import db
+from .models import Maker, Heatsink, FanConfig, Measurement
+from .snapshots import versioned
+
+
+__all__ = ['Point', 'skyline', 'build_points', 'get_points', 'get_frontier']
+
+
+#: A measurement joined with its fan config, heatsink and maker.
+Point = namedtuple('Point', [
+    'noise', 'cpu_temp_delta', 'price', 'measurement_id', 'fan_config_id',
+    'heatsink_id', 'maker', 'heatsink_type', 'fan_size', 'fan_count'])
+
+
+def skyline(points):
+    """Returns the points in *points* that are not dominated by any other
+    point, in the same order. A point dominates another if it is not worse
+    in any of *noise*, *cpu_temp_delta* and *price* and better in at least
+    one of them. *points* must be sorted by the three values, in that order.
+
+    A point can only be dominated by a point before it, so the sweep keeps
+    the best prices seen so far as a staircase, a list sorted by
+    *cpu_temp_delta* in which prices strictly decrease, and checks each
+    point against it with a binary search.
+
+    """
+    temps = []
+    prices = []
+    frontier = []
+    last = None
+    for point in points:
+        key = point[:3]
+        if key == last:
+            # Equal points don't dominate each other.
+            frontier.append(point)
+            continue
+        noise, temp, price = key
+        i = bisect_right(temps, temp)
+        if i and prices[i - 1] <= price:
+            continue
+        frontier.append(point)
+        last = key
+        # Remove the steps that the new point dominates.
+        j = i
+        while j < len(temps) and prices[j] >= price:
+            j += 1
+        temps[i:j] = [temp]
+        prices[i:j] = [price]
+    return frontier
+
+
+def build_points(version):
+    """Returns a mapping from each CPU power consumption to a tuple of a
+    list of :class:`Point` objects of the measurements at it, sorted for
+    :func:`skyline`, and the frontier of them. Measurements of heatsinks
+    whose price is unknown are left out. *version* is not used and the
+    current data is always used.
+
+    """
+    rows = db.session.query(
+        Measurement.power, Measurement.noise, Measurement.cpu_temp_delta,
+        Heatsink.price, Measurement.id, FanConfig.id, Heatsink.id,
+        Maker.name, Heatsink.heatsink_type, FanConfig.fan_size,
+        FanConfig.fan_count).join(
+        FanConfig, FanConfig.id == Measurement.fan_config_id).join(
+        Heatsink, Heatsink.id == FanConfig.heatsink_id).join(
+        Maker, Maker.id == Heatsink.maker_id).filter(
+        Heatsink.price.isnot(None))
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[0], []).append(Point(*row[1:]))
+    points = {}
+    for power, group in groups.items():
+        group.sort()
+        points[power] = (group, skyline(group))
+    return points
+
+
+#: Returns the points of :func:`build_points` for the current data version.
+#: See :func:`~cpucoolerchart.snapshots.versioned`.
+get_points = versioned('frontier', build_points)
+
+
+def get_frontier(power, price_max=None, **filters):
+    """Returns the frontier of the measurements at *power* as a list of
+    :class:`Point` objects. Only heatsinks that cost at most *price_max* and
+    points whose fields are equal to *filters*, e.g. ``fan_size=120``, are
+    considered. Without filters, the frontier computed in advance is
+    returned.
+
+    """
+    points, frontier = get_points().get(power, ([], []))
+    if price_max is None and not filters:
+        return frontier
+    points = [point for point in points
+              if (price_max is None or point.price <= price_max) and
+              all(getattr(point, name) == value
+                  for name, value in filters.items())]
+    return skyline(points)
@@ -0,0 +1,130 @@
+"""
+    cpucoolerchart.interpolation
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Estimates CPU temperatures at noise levels and CPU power consumptions
+    between those at which the measurements are taken. The measurements of
+    each fan config are arranged in a grid once per data version and
+    estimates are interpolated bilinearly for many queries at once with
+    NumPy__.
+
+    Bilinear interpolation keeps the order of the measurements: if the
+    temperature goes down as the noise level goes up, so do the estimates
+    between them.
+
+    NumPy is optional. If it is not installed, :func:`get_grids` returns
+    ``None``.
+
+    __ http://www.numpy.org/
+
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .crawler import NOISE_MAX, NOISE_LEVELS, CPU_POWER
+from .extensions import db
+from .models import Measurement
+from .snapshots import versioned
+
+
+__all__ = ['GRID_NOISE_LEVELS', 'GRID_CPU_POWER', 'build_grids', 'get_grids',
+           'interpolate']
+
+
+#: Noise levels of the grid. :data:`~cpucoolerchart.crawler.NOISE_MAX` is
+#: left out, since it is not an actual noise level.
+GRID_NOISE_LEVELS = [noise for noise in NOISE_LEVELS if noise != NOISE_MAX]
+
+#: CPU power consumptions of the grid.
+GRID_CPU_POWER = list(CPU_POWER)
+
+
+def build_grids(version):
+    """Arranges *cpu_temp_delta* of all measurements in grids. Returns a
+    mapping with two keys, or ``None`` if NumPy is not installed:
+
+    - *fan_config_id*: a sorted array of the ids of fan configs.
+    - *cpu_temp_delta*: an array of shape ``(len(fan_config_id),
+      len(GRID_NOISE_LEVELS), len(GRID_CPU_POWER))``. NaN if there is no
+      measurement for the cell.
+
+    *version* is not used and the current data is always used.
+
+    """
+    if numpy is None:
+        return None
+    rows = db.session.query(
+        Measurement.fan_config_id, Measurement.noise, Measurement.power,
+        Measurement.cpu_temp_delta).filter(
+        Measurement.noise.in_(GRID_NOISE_LEVELS),
+        Measurement.power.in_(GRID_CPU_POWER)).all()
+    columns = list(zip(*rows)) or [()] * 4
+    fan_config_ids = numpy.array(columns[0], dtype=numpy.int64)
+    ids, fan_configs = numpy.unique(fan_config_ids, return_inverse=True)
+    noise = numpy.searchsorted(GRID_NOISE_LEVELS, numpy.array(columns[1]))
+    power = numpy.searchsorted(GRID_CPU_POWER, numpy.array(columns[2]))
+    grid = numpy.full((len(ids), len(GRID_NOISE_LEVELS),
+                       len(GRID_CPU_POWER)), numpy.nan)
+    grid[fan_configs, noise, power] = numpy.array(columns[3],
+                                                  dtype=numpy.float64)
+    return {'fan_config_id': ids, 'cpu_temp_delta': grid}
+
+
+#: Returns the grids of :func:`build_grids` for the current data version.
+#: See :func:`~cpucoolerchart.snapshots.versioned`.
+get_grids = versioned('grids', build_grids)
+
+
+def _locate(axis, values):
+    """Returns the indices of the lower bounds of the cells of *axis* that
+    contain *values* and the relative positions in the cells. Positions of
+    values out of the range of *axis* are NaN.
+
+    """
+    axis = numpy.array(axis, dtype=numpy.float64)
+    indices = numpy.searchsorted(axis, values, side='right') - 1
+    indices = numpy.clip(indices, 0, len(axis) - 2)
+    lower, upper = axis[indices], axis[indices + 1]
+    t = (values - lower) / (upper - lower)
+    t[(values < axis[0]) | (values > axis[-1])] = numpy.nan
+    return indices, t
+
+
+def interpolate(grids, fan_config_ids, noise, power):
+    """Returns an array of the estimated *cpu_temp_delta* for each element
+    of *fan_config_ids*, *noise* and *power*, which are broadcast together,
+    using *grids* returned by :func:`get_grids`. An estimate is NaN if the
+    fan config is unknown, the target is out of the range of the grid or any
+    of the four surrounding measurements is missing.
+
+    """
+    fan_config_ids, noise, power = numpy.broadcast_arrays(
+        numpy.asarray(fan_config_ids, dtype=numpy.int64),
+        numpy.asarray(noise, dtype=numpy.float64),
+        numpy.asarray(power, dtype=numpy.float64))
+    shape = fan_config_ids.shape
+    fan_config_ids, noise, power = [
+        x.ravel() for x in (fan_config_ids, noise, power)]
+    ids = grids['fan_config_id']
+    result = numpy.full(fan_config_ids.shape, numpy.nan)
+    if not len(ids):
+        return result.reshape(shape)
+    f = numpy.searchsorted(ids, fan_config_ids)
+    f[f >= len(ids)] = 0
+    found = ids[f] == fan_config_ids
+    i, t = _locate(GRID_NOISE_LEVELS, noise)
+    j, u = _locate(GRID_CPU_POWER, power)
+    grid = grids['cpu_temp_delta']
+    values = numpy.zeros(result.shape)
+    for di, dj, weight in ((0, 0, (1 - t) * (1 - u)), (1, 0, t * (1 - u)),
+                           (0, 1, (1 - t) * u), (1, 1, t * u)):
+        # Corners of zero weight are skipped, so that a target on an edge
+        # of a cell does not need the measurements on the opposite edge.
+        values += numpy.where(weight > 0, grid[f, i + di, j + dj] * weight,
+                              0)
+    found &= ~(numpy.isnan(t) | numpy.isnan(u))
+    result[found] = values[found]
+    return result.reshape(shape)
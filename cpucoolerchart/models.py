@@ -8,6 +8,7 @@
 
 from flask.ext.sqlalchemy import BaseQuery
 
+from ._compat import OrderedDict
 from .extensions import db
 
 
@@ -17,8 +18,31 @@ class BaseModel(db.Model):
     """
     __abstract__ = True
 
-    def _column_names(self):
-        return self.__table__.columns.keys()
+    @classmethod
+    def _column_names(cls):
+        """Returns a tuple of the column names of the model. It is computed
+        once per class.
+
+        """
+        names = cls.__dict__.get('_cached_column_names')
+        if names is None:
+            names = tuple(cls.__table__.columns.keys())
+            cls._cached_column_names = names
+        return names
+
+    @classmethod
+    def _column_attributes(cls):
+        """Returns a tuple of the instrumented attributes of the columns in
+        the same order as :meth:`_column_names`. It is computed once per
+        class.
+
+        """
+        attributes = cls.__dict__.get('_cached_column_attributes')
+        if attributes is None:
+            attributes = tuple(getattr(cls, name)
+                               for name in cls._column_names())
+            cls._cached_column_attributes = attributes
+        return attributes
 
     def update(self, **kwargs):
         """Updates the current instance. Example:
@@ -64,7 +88,7 @@ class BaseModel(db.Model):
         values = ', '.join('{0}={1!r}'.format(k, getattr(self, k)) for k
                            in self._column_names())
         return '{model_name}({values})'.format(
-            model_name=self.__mapper__.class_.__name__,
+            model_name=self.__class__.__name__,
             values=values)
 
     def __eq__(self, other):
@@ -78,8 +102,36 @@ class BaseModel(db.Model):
         def find(self, **kwargs):
             return self.filter_by(**kwargs).scalar()
 
+        def _column_rows(self):
+            """Returns a tuple of the column names of the queried model and
+            the rows of the values of the columns. Only plain tuples are
+            fetched, without creating model instances or adding them to the
+            identity map.
+
+            """
+            model = self.column_descriptions[0]['type']
+            rows = self.with_entities(*model._column_attributes()).all()
+            return model._column_names(), rows
+
         def all_as_dict(self):
-            return [obj.as_dict() for obj in self.all()]
+            """Returns all rows as a list of mappings like
+            :meth:`BaseModel.as_dict`. Only the column values are fetched and
+            no model instances are created.
+
+            """
+            names, rows = self._column_rows()
+            return [dict(zip(names, row)) for row in rows]
+
+        def all_as_columns(self):
+            """Returns the values of all rows column by column, as an
+            :class:`~collections.OrderedDict` that maps each column name to a
+            list of values. Only the column values are fetched and no model
+            instances are created.
+
+            """
+            names, rows = self._column_rows()
+            return OrderedDict((name, [row[i] for row in rows])
+                               for i, name in enumerate(names))
 
     query_class = Query
 
@@ -112,7 +164,10 @@ class Heatsink(BaseModel):
                             order_by=name.asc(),
                             cascade='all, delete-orphan'))
 
-    __table_args__ = (db.UniqueConstraint('name', 'maker_id'),)
+    __table_args__ = (
+        db.UniqueConstraint('name', 'maker_id'),
+        db.Index('ix_heatsink_heatsink_type_price', 'heatsink_type', 'price'),
+    )
 
 
 class FanConfig(BaseModel):
@@ -129,8 +184,11 @@ class FanConfig(BaseModel):
                                          fan_count.asc()),
                                cascade='all, delete-orphan'))
 
-    __table_args__ = (db.UniqueConstraint('heatsink_id', 'fan_size',
-                                          'fan_thickness', 'fan_count'),)
+    __table_args__ = (
+        db.UniqueConstraint('heatsink_id', 'fan_size', 'fan_thickness',
+                            'fan_count'),
+        db.Index('ix_fan_config_fan_size_fan_count', 'fan_size', 'fan_count'),
+    )
 
 
 class Measurement(BaseModel):
@@ -155,4 +213,72 @@ class Measurement(BaseModel):
         order_by=(noise.asc(), power.asc()),
         cascade='all, delete-orphan'))
 
-    __table_args__ = (db.UniqueConstraint('fan_config_id', 'noise', 'power'),)
+    __table_args__ = (
+        db.UniqueConstraint('fan_config_id', 'noise', 'power'),
+        db.Index('ix_measurement_noise_power_cpu_temp_delta', 'noise',
+                 'power', 'cpu_temp_delta'),
+    )
+
+
+class SourcePage(BaseModel):
+    """Represents a Coolenjoy chart page for a specific fan noise and CPU
+    power consumption target. It keeps the digest of the page content as of
+    the last successful update.
+
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    noise = db.Column(db.Integer, nullable=False)
+    power = db.Column(db.Integer, nullable=False)
+    digest = db.Column(db.String(40), nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('noise', 'power'),)
+
+
+class DataVersion(BaseModel):
+    """Represents a version of the data. A new version is created each time
+    the data is successfully updated, and *id* is the version number.
+
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+
+class Changeset(BaseModel):
+    """Represents the set of rows changed by the update that created a data
+    version. *id* is the version number. Only versions having a changeset can
+    be used as a base of incremental changes.
+
+    """
+
+    id = db.Column(db.Integer, db.ForeignKey('data_version.id'),
+                   primary_key=True, autoincrement=False)
+
+
+class RowChange(BaseModel):
+    """Represents a row inserted, updated or deleted in a data version.
+    *action* is one of ``"insert"``, ``"update"`` and ``"delete"``.
+
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, db.ForeignKey('changeset.id'),
+                        nullable=False, index=True)
+    table_name = db.Column(db.String(31), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(7), nullable=False)
+
+
+class RowDigest(BaseModel):
+    """Represents the digest of a row as of the latest data version. Changes
+    are detected by comparing rows with their digests.
+
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(31), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    digest = db.Column(db.String(40), nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('table_name', 'row_id'),)
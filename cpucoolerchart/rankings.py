@@ -0,0 +1,112 @@
+"""
+    cpucoolerchart.rankings
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Implements the ranking index that answers which fan configs have the
+    lowest CPU temperature at a noise level and CPU power consumption. For
+    each pair of them, measurements are sorted once per data version, so
+    queries only walk or bisect the sorted arrays.
+
+"""
+
+from bisect import bisect_left
+
+from .extensions import db
+from .models import Heatsink, FanConfig, Measurement
+from .snapshots import versioned
+
+
+__all__ = ['Ranking', 'build_rankings', 'get_rankings']
+
+
+class Ranking(object):
+    """Measurements of a noise level and CPU power consumption sorted by
+    *cpu_temp_delta* in ascending order. *entries* is a list of tuples of
+    ``(cpu_temp_delta, measurement_id, fan_config_id, heatsink_id, price)``
+    already sorted.
+
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.temps = [entry[0] for entry in entries]
+        self.heatsinks = {}
+        for i, entry in enumerate(entries):
+            self.heatsinks.setdefault(entry[3], i)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def rank(self, index):
+        """Returns the rank of the entry at *index*. Entries having the same
+        *cpu_temp_delta* have the same rank, which is one plus the number of
+        entries having a lower *cpu_temp_delta*. Takes O(log n) time.
+
+        """
+        return bisect_left(self.temps, self.temps[index]) + 1
+
+    def top(self, limit, price_max=None):
+        """Returns the indices of up to *limit* entries with the lowest
+        *cpu_temp_delta*. If *price_max* is given, entries whose price is
+        unknown or higher than that are skipped. Takes O(*limit*) time
+        without *price_max*, and stops as soon as *limit* entries are found
+        with it.
+
+        """
+        indices = []
+        for i, entry in enumerate(self.entries):
+            if len(indices) >= limit:
+                break
+            if price_max is not None and (entry[4] is None or
+                                          entry[4] > price_max):
+                continue
+            indices.append(i)
+        return indices
+
+    def heatsink_index(self, heatsink_id):
+        """Returns the index of the best entry of *heatsink_id*, or ``None``
+        if there is no entry for it. Takes O(1) time.
+
+        """
+        return self.heatsinks.get(heatsink_id)
+
+    def as_dict(self, index):
+        """Returns the entry at *index* as a mapping including its rank."""
+        temp, measurement_id, fan_config_id, heatsink_id, price = \
+            self.entries[index]
+        return {
+            'rank': self.rank(index),
+            'measurement_id': measurement_id,
+            'fan_config_id': fan_config_id,
+            'heatsink_id': heatsink_id,
+            'cpu_temp_delta': temp,
+            'price': price,
+        }
+
+
+def build_rankings(version):
+    """Builds a :class:`Ranking` for each pair of a noise level and a CPU
+    power consumption from the database with a single query. Returns a
+    mapping from ``(noise, power)`` to the rankings. *version* is not used
+    and the current data is always used.
+
+    """
+    rows = db.session.query(
+        Measurement.noise, Measurement.power, Measurement.cpu_temp_delta,
+        Measurement.id, Measurement.fan_config_id, FanConfig.heatsink_id,
+        Heatsink.price).join(
+        FanConfig, FanConfig.id == Measurement.fan_config_id).join(
+        Heatsink, Heatsink.id == FanConfig.heatsink_id)
+    groups = {}
+    for row in rows:
+        groups.setdefault((row[0], row[1]), []).append(tuple(row[2:]))
+    rankings = {}
+    for key, entries in groups.items():
+        entries.sort()
+        rankings[key] = Ranking(entries)
+    return rankings
+
+
+#: Returns the rankings for the current data version. See
+#: :func:`~cpucoolerchart.snapshots.versioned`.
+get_rankings = versioned('rankings', build_rankings)
@@ -0,0 +1,128 @@
+# -*- coding: UTF-8 -*-
+"""
+    cpucoolerchart.scoring
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Computes derived metrics of all measurements with NumPy__. Measurements
+    and heatsink prices are loaded into arrays once per data version and the
+    metrics of the whole data set are computed with vectorized operations.
+
+    NumPy is optional. If it is not installed, :func:`get_scores` returns
+    ``None``.
+
+    __ http://www.numpy.org/
+
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .extensions import db
+from .models import Heatsink, FanConfig, Measurement
+from .snapshots import versioned
+
+
+__all__ = ['SCORE_COLUMNS', 'build_scores', 'get_scores', 'scores_of',
+           'to_list']
+
+
+#: Names of the metrics computed by :func:`build_scores`.
+SCORE_COLUMNS = ['headroom', 'headroom_per_10k_krw', 'score']
+
+
+def build_scores(version):
+    """Computes the metrics of all measurements. Returns a mapping from
+    column names to arrays of the same length, ordered by measurement id, or
+    ``None`` if NumPy is not installed. The arrays are:
+
+    - *measurement_id*, *noise*, *power*, *cpu_temp_delta* and *price*: the
+      data. *price* is NaN if it is unknown.
+    - *headroom*: how much cooler the CPU is in °C than with the worst fan
+      config measured at the same noise level and CPU power consumption.
+    - *headroom_per_10k_krw*: *headroom* per 10,000 KRW of the price of the
+      heatsink. NaN if the price is unknown.
+    - *score*: the number of standard deviations by which the CPU
+      temperature is lower than the average of the fan configs measured at
+      the same noise level and CPU power consumption. Scores are comparable
+      across noise levels, since each one is normalized within its own
+      noise level.
+
+    *version* is not used and the current data is always used.
+
+    """
+    if numpy is None:
+        return None
+    rows = db.session.query(
+        Measurement.id, Measurement.noise, Measurement.power,
+        Measurement.cpu_temp_delta, Heatsink.price).join(
+        FanConfig, FanConfig.id == Measurement.fan_config_id).join(
+        Heatsink, Heatsink.id == FanConfig.heatsink_id).order_by(
+        Measurement.id).all()
+    columns = list(zip(*rows)) or [()] * 5
+    arrays = {}
+    for i, (name, dtype) in enumerate([('measurement_id', numpy.int64),
+                                       ('noise', numpy.int64),
+                                       ('power', numpy.int64),
+                                       ('cpu_temp_delta', numpy.float64),
+                                       ('price', numpy.float64)]):
+        arrays[name] = numpy.array(columns[i], dtype=dtype)
+    temp = arrays['cpu_temp_delta']
+
+    # Index of the (noise, power) group of each measurement
+    keys = arrays['noise'] * 10000 + arrays['power']
+    groups = numpy.unique(keys, return_inverse=True)[1]
+    counts = numpy.bincount(groups).astype(numpy.float64)
+
+    worst = numpy.full(len(counts), -numpy.inf)
+    numpy.maximum.at(worst, groups, temp)
+    headroom = worst[groups] - temp
+
+    mean = numpy.bincount(groups, weights=temp) / counts
+    deviation = mean[groups] - temp
+    std = numpy.sqrt(numpy.bincount(groups, weights=deviation ** 2) / counts)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        score = numpy.where(std[groups] > 0, deviation / std[groups], 0.0)
+        per_price = headroom / arrays['price'] * 10000
+    per_price[~numpy.isfinite(per_price)] = numpy.nan
+
+    arrays['headroom'] = numpy.round(headroom, 1)
+    arrays['headroom_per_10k_krw'] = numpy.round(per_price, 4)
+    arrays['score'] = numpy.round(score, 3)
+    return arrays
+
+
+#: Returns the arrays of :func:`build_scores` for the current data version.
+#: See :func:`~cpucoolerchart.snapshots.versioned`.
+get_scores = versioned('scores', build_scores)
+
+
+def scores_of(scores, measurement_ids):
+    """Returns a list of the values of :data:`SCORE_COLUMNS` for each id in
+    *measurement_ids*, looked up in *scores* returned by :func:`get_scores`
+    with a single vectorized search. NaNs and unknown ids are ``None``.
+
+    """
+    ids = scores['measurement_id']
+    if not len(ids):
+        return [(None,) * len(SCORE_COLUMNS)] * len(measurement_ids)
+    wanted = numpy.array(measurement_ids, dtype=numpy.int64)
+    indices = numpy.searchsorted(ids, wanted)
+    indices[indices >= len(ids)] = 0
+    found = ids[indices] == wanted
+    columns = [to_list(scores[name][indices], found)
+               for name in SCORE_COLUMNS]
+    return list(zip(*columns))
+
+
+def to_list(values, mask=None):
+    """Converts *values*, a NumPy array, to a list. NaNs and values where
+    *mask* is ``False`` are ``None``.
+
+    """
+    values = values.astype(object)
+    values[numpy.isnan(values.astype(numpy.float64))] = None
+    if mask is not None:
+        values[~mask] = None
+    return values.tolist()
@@ -0,0 +1,587 @@
+"""
+    cpucoolerchart.snapshots
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Implements prebuilt response snapshots. The responses of read endpoints
+    are rendered once for each data version, right after an update, and
+    served as they are until the next version.
+
+"""
+
+import binascii
+from functools import update_wrapper
+import json
+import os
+import threading
+import time
+import zlib
+
+from flask import (Response, current_app, g, jsonify, make_response,
+                   request, stream_with_context)
+from werkzeug.datastructures import MultiDict
+from werkzeug.urls import url_encode
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from .extensions import cache
+from .models import DataVersion
+
+
+#: The media type of MessagePack responses.
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+#: A number of seconds between checks for a snapshot being rendered by
+#: another request.
+SNAPSHOT_POLL_INTERVAL = 0.05
+
+#: Functions registered with :func:`versioned`, keyed by name.
+_builders = {}
+
+#: Prefixes of the cache keys whose values are also kept in the memory of
+#: each process by :class:`~cpucoolerchart.cache.LocalCache`. Snapshots never
+#: change for a version, and the current version is invalidated when it
+#: changes.
+LOCAL_CACHE_PREFIXES = ('snapshot/', 'data_version')
+
+
+__all__ = ['get_data_version', 'publish_data_version', 'snapshot',
+           'make_etag', 'build_snapshots', 'versioned',
+           'is_data_unpublished', 'set_data_unpublished',
+           'unset_data_unpublished']
+
+
+def get_data_version():
+    """Returns a tuple of the current data version number and the time when
+    it was created. The version number is ``0`` and the time is ``None`` if
+    the data has never been updated. The value is cached, so that the
+    database is queried only if the cache has been cleared. While
+    :func:`publish_data_version` renders snapshots, the version being
+    published is returned instead.
+
+    """
+    rv = getattr(g, '_publishing_data_version', None)
+    if rv is not None:
+        return rv
+    rv = cache.get('data_version')
+    if rv is None:
+        rv = _latest_data_version()
+        cache.set('data_version', rv,
+                  timeout=current_app.config['SNAPSHOT_TIMEOUT'])
+    return rv
+
+
+def _latest_data_version():
+    row = DataVersion.query.order_by(DataVersion.id.desc()).first()
+    if row is None:
+        return 0, None
+    return row.id, row.created_at
+
+
+def publish_data_version():
+    """Renders snapshots and builds values registered with :func:`versioned`
+    for the latest data version in the database and then makes it the
+    current version. Requests never see a version whose snapshots are not
+    yet built.
+
+    """
+    version = _latest_data_version()
+    for name, build in _builders.items():
+        cache.set(versioned_key(name, version[0]), build(version[0]),
+                  timeout=current_app.config['SNAPSHOT_TIMEOUT'])
+    g._publishing_data_version = version
+    try:
+        build_snapshots(version[0])
+    finally:
+        del g._publishing_data_version
+    cache.set('data_version', version,
+              timeout=current_app.config['SNAPSHOT_TIMEOUT'])
+    unset_data_unpublished()
+    return version
+
+
+def is_data_unpublished():
+    """Returns ``True`` if the database may have changes that are not
+    published as a data version yet, e.g. an update is in progress or has
+    failed halfway. Responses and values rendered from the database are not
+    stored for the current version then, since they may not match it. They
+    are always stored while :func:`publish_data_version` runs.
+
+    """
+    if getattr(g, '_publishing_data_version', None) is not None:
+        return False
+    return bool(cache.get('data_unpublished'))
+
+
+def set_data_unpublished():
+    cache.set('data_unpublished', True,
+              timeout=current_app.config['SNAPSHOT_TIMEOUT'])
+
+
+def unset_data_unpublished():
+    cache.delete('data_unpublished')
+
+
+def versioned_key(name, version):
+    return '{0}/{1}'.format(name, version)
+
+
+def versioned(name, build):
+    """Registers *build*, a function that takes a data version number and
+    builds a value derived from the data, e.g. an index, under *name*. Values
+    are built for each version when it is published and stored in the cache.
+    Returns a function that returns the value for the current data version.
+    The value is kept in memory for each app, and loaded from the cache, or
+    built if it is not in the cache, when the data version changes. Values
+    built while :func:`is_data_unpublished` returns ``True`` are not kept::
+
+        def build_index(version):
+            return dict((x.id, x) for x in Heatsink.query)
+
+        get_index = versioned('index', build_index)
+
+    """
+    _builders[name] = build
+
+    def get():
+        version = get_data_version()
+        memo = current_app.extensions.setdefault(
+            'cpucoolerchart.versioned', {})
+        if name in memo and memo[name][0] == version:
+            return memo[name][1]
+        key = versioned_key(name, version[0])
+        value = cache.get(key)
+        if value is None:
+            value = build(version[0])
+            if is_data_unpublished():
+                return value
+            cache.set(key, value,
+                      timeout=current_app.config['SNAPSHOT_TIMEOUT'])
+        memo[name] = (version, value)
+        return value
+
+    return get
+
+
+def snapshot_key(version, encoding=None, query=None, variant=None):
+    """Returns the cache key of the snapshot of the current request for
+    *version*. If *encoding* is given, it is the key of the variant
+    compressed with the encoding. *query* is a normalized query string
+    that is a part of the key. If *variant* is given, it is the key of
+    the variant in another format, e.g. ``"msgpack"``.
+
+    """
+    key = 'snapshot/{0}{1}'.format(version, request.path)
+    if query:
+        key += '?' + query
+    if variant is not None:
+        key += ':' + variant
+    if encoding is not None:
+        key += ':' + encoding
+    return key
+
+
+def snapshot(f=None, query_args=None, mimetype='application/json'):
+    """Decorator that serves the response of a view function from a snapshot
+    for the current data version. If there is no snapshot, e.g. the cache has
+    been cleared, the view function is called and its response is stored as
+    a snapshot. Only responses with status code 200 are stored.
+
+    By default the query string is ignored. If the view function accepts
+    query parameters, pass a function as *query_args* that takes
+    :attr:`request.args` and returns a list of ``(name, value)`` pairs of the
+    parameters the view function understands. Snapshots are stored for each
+    distinct list, so equivalent query strings share a snapshot. If the
+    function raises :exc:`ValueError`, a 400 Bad Request response with the
+    error message is returned::
+
+        @app.route('/items')
+        @snapshot(query_args=parse_item_filters)
+        def items():
+            ...
+
+    Snapshots for query strings are stored as they are requested, whereas
+    the one without a query string is built right after each update. Since
+    there can be any number of query strings, their snapshots are kept for
+    ``SNAPSHOT_QUERY_TIMEOUT`` seconds only and stored only as they are;
+    they are compressed and encoded in MessagePack for each request.
+
+    A compressed variant of a snapshot without a query string is stored for
+    each of ``SNAPSHOT_ENCODINGS`` as well, and the variant is chosen
+    according to ``Accept-Encoding``. If msgpack__ is installed, JSON
+    responses are also stored encoded in MessagePack, which is sent to
+    clients that prefer it in ``Accept``. Pass the media type of the
+    responses as *mimetype* if the view function doesn't return JSON, so
+    that ``Accept`` is ignored for it.
+
+    __ https://pypi.python.org/pypi/msgpack-python
+
+    Streamed responses, e.g. large exports, are stored as well, so they are
+    rendered only once for each version. The request that renders one gets
+    it streamed, and compressed on the fly, while its chunks are collected,
+    and the snapshot is stored when the stream ends. Snapshots are served
+    whole, since they are in memory anyway, and the ones built right after
+    an update are joined at once.
+
+    If a snapshot is missing, e.g. it has been evicted, only one request
+    renders it at a time across all processes, holding a lock in the cache
+    for at most ``SNAPSHOT_LOCK_TIMEOUT`` seconds. Concurrent requests for
+    the same snapshot wait for it to be stored for up to
+    ``SNAPSHOT_LOCK_WAIT`` seconds and render it by themselves only if it
+    isn't stored by then.
+
+    A snapshot read more than ``SNAPSHOT_SOFT_TIMEOUT`` seconds after it was
+    stored is stored again as it is, with a new expiration time, in a
+    background thread holding the same lock. Snapshots never change within a
+    version, so it is not rendered again, and snapshots that are read
+    regularly never expire.
+
+    While the database has changes that are not published yet (see
+    :func:`is_data_unpublished`), rendered responses are served but not
+    stored, so that no snapshot of a version has data of another one.
+
+    Responses carry validators for the data version (see
+    :func:`set_validators`), and conditional requests that match them are
+    answered with 304 Not Modified without loading the snapshot.
+
+    """
+    if f is None:
+        return lambda f: snapshot(f, query_args, mimetype)
+
+    def render(version, query=None, done=None):
+        # If *done* is given, it is called when the response is stored or
+        # not to be stored, and a streamed response is streamed as it is.
+        resp = make_response(f())
+        if resp.status_code == 200 and not is_data_unpublished():
+            if resp.is_streamed and done is not None:
+                return tee(version, query, resp, done)
+            if resp.is_streamed:
+                resp.set_data(b''.join(resp.iter_encoded()))
+            store(version, query, None, resp)
+            if (not query and msgpack is not None and
+                    resp.mimetype == 'application/json'):
+                store(version, query, 'msgpack', to_msgpack(resp))
+        if done is not None:
+            done()
+        return resp
+
+    def tee(version, query, resp, done):
+        headers = list(resp.headers)
+        chunks = resp.iter_encoded()
+        app = current_app._get_current_object()
+
+        def generate():
+            body = []
+            for chunk in chunks:
+                body.append(chunk)
+                yield chunk
+            store(version, query, None,
+                  Response(b''.join(body), headers=headers))
+
+        def close():
+            with app.app_context():
+                done()
+
+        resp.response = stream_with_context(generate())
+        resp.call_on_close(close)
+        return resp
+
+    def store(version, query, variant, resp):
+        headers = [(k, v) for k, v in resp.headers
+                   if k.lower() != 'content-length']
+        body = resp.get_data()
+        timeout = snapshot_timeout(query)
+        encodings = () if query else current_app.config['SNAPSHOT_ENCODINGS']
+        refresh_at = time.time() + current_app.config['SNAPSHOT_SOFT_TIMEOUT']
+        cache.set(snapshot_key(version, None, query, variant),
+                  (headers, body, refresh_at), timeout=timeout)
+        for encoding in encodings:
+            cache.set(snapshot_key(version, encoding, query, variant),
+                      (headers, compress(body, encoding), refresh_at),
+                      timeout=timeout)
+
+    def load_or_render(version, query, key):
+        data = cache.get(key)
+        if data is not None:
+            # Snapshots stored without the time are refreshed as well.
+            if len(data) < 3 or data[2] <= time.time():
+                refresh(version, query, key)
+            return data
+        lock = 'lock/' + snapshot_key(version, None, query)
+        token = acquire_lock(lock)
+        if token is not None:
+            def done():
+                release_lock(lock, token)
+            try:
+                return render(version, query, done)
+            except Exception:
+                done()
+                raise
+        data = wait_for_snapshot(key, lock)
+        if data is not None:
+            return data
+        return render(version, query, lambda: None)
+
+    def refresh(version, query, key):
+        lock = 'lock/' + snapshot_key(version, None, query)
+        token = acquire_lock(lock)
+        if token is None:
+            return
+        app = current_app._get_current_object()
+        timeout = snapshot_timeout(query)
+
+        def run():
+            with app.app_context():
+                try:
+                    data = cache.get(key)
+                    # It may have been refreshed since it was read.
+                    if data is None or (len(data) >= 3 and
+                                        data[2] > time.time()):
+                        return
+                    refresh_at = (time.time() +
+                                  app.config['SNAPSHOT_SOFT_TIMEOUT'])
+                    cache.set(key, tuple(data[:2]) + (refresh_at,),
+                              timeout=timeout)
+                except Exception:
+                    app.logger.exception('Could not refresh the snapshot '
+                                         '{0}'.format(key))
+                finally:
+                    release_lock(lock, token)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def wrapped_function():
+        query = None
+        if query_args is not None:
+            try:
+                query = url_encode(query_args(request.args), sort=True)
+            except ValueError as e:
+                resp = jsonify(msg=str(e))
+                resp.status_code = 400
+                return resp
+        version, created_at = get_data_version()
+        encoding = negotiate_encoding()
+        variant = None
+        if mimetype == 'application/json':
+            variant = negotiate_variant()
+        if version and not_modified(version, created_at, encoding, variant):
+            resp = Response(status=304)
+        else:
+            if query:
+                key = snapshot_key(version, None, query)
+            else:
+                key = snapshot_key(version, encoding, query, variant)
+            data = load_or_render(version, query, key)
+            if isinstance(data, tuple):
+                headers, body = data[:2]
+                resp = Response(body, headers=headers)
+            else:
+                resp = data
+            # Snapshots for query strings and responses just rendered are
+            # stored as they are, so they are converted here.
+            if query or not isinstance(data, tuple):
+                if variant is not None:
+                    if (resp.status_code == 200 and not resp.is_streamed and
+                            resp.mimetype == 'application/json'):
+                        resp = to_msgpack(resp)
+                    else:
+                        variant = None
+                if resp.status_code != 200 or encoding is None:
+                    encoding = None
+                elif resp.is_streamed:
+                    resp.response = compress_iter(resp.iter_encoded(),
+                                                  encoding)
+                else:
+                    resp.set_data(compress(resp.get_data(), encoding))
+        if encoding is not None:
+            resp.headers['Content-Encoding'] = encoding
+        if current_app.config['SNAPSHOT_ENCODINGS']:
+            resp.vary.add('Accept-Encoding')
+        if msgpack is not None and mimetype == 'application/json':
+            resp.vary.add('Accept')
+        if version:
+            set_validators(resp, version, created_at, encoding, variant)
+        return resp
+
+    wrapped_function = update_wrapper(wrapped_function, f)
+    wrapped_function.render_snapshot = render
+    wrapped_function.snapshot_query_args = query_args
+    return wrapped_function
+
+
+def snapshot_timeout(query=None):
+    """Returns the number of seconds for which a snapshot is stored. Those
+    for query strings are stored for a shorter time.
+
+    """
+    if query:
+        return current_app.config['SNAPSHOT_QUERY_TIMEOUT']
+    return current_app.config['SNAPSHOT_TIMEOUT']
+
+
+def acquire_lock(lock):
+    """Takes *lock*, a cache key, for at most ``SNAPSHOT_LOCK_TIMEOUT``
+    seconds across all processes. Returns a token to release it with, or
+    ``None`` if it is already taken.
+
+    """
+    token = binascii.hexlify(os.urandom(8))
+    timeout = current_app.config['SNAPSHOT_LOCK_TIMEOUT']
+    # Flask-Cache's add() doesn't return whether the key was added.
+    if cache.cache.add(lock, token, timeout=timeout):
+        return token
+    return None
+
+
+def release_lock(lock, token):
+    """Releases *lock* taken with *token* by :func:`acquire_lock`."""
+    # Not atomic, but the lock only expires if the holder takes longer than
+    # its timeout.
+    if cache.get(lock) == token:
+        cache.delete(lock)
+
+
+def wait_for_snapshot(key, lock):
+    """Waits for another request holding *lock* to store the snapshot of
+    *key* and returns it. Returns ``None`` if the lock is released without
+    the snapshot stored, e.g. the response is not stored, or
+    ``SNAPSHOT_LOCK_WAIT`` seconds pass.
+
+    """
+    deadline = time.time() + current_app.config['SNAPSHOT_LOCK_WAIT']
+    while time.time() < deadline:
+        time.sleep(SNAPSHOT_POLL_INTERVAL)
+        data = cache.get(key)
+        if data is not None or cache.get(lock) is None:
+            return data
+    return None
+
+
+def negotiate_encoding():
+    """Returns the best content coding among ``SNAPSHOT_ENCODINGS`` for the
+    current request according to ``Accept-Encoding``, or ``None`` if the
+    response should not be compressed.
+
+    """
+    encodings = list(current_app.config['SNAPSHOT_ENCODINGS'])
+    if not encodings or not request.accept_encodings:
+        return None
+    best = request.accept_encodings.best_match(encodings + ['identity'])
+    return best if best != 'identity' else None
+
+
+def negotiate_variant():
+    """Returns ``"msgpack"`` if the current request prefers MessagePack to
+    JSON according to ``Accept`` and msgpack is installed, or ``None``
+    otherwise.
+
+    """
+    if msgpack is None:
+        return None
+    best = request.accept_mimetypes.best_match(
+        ['application/json', MSGPACK_MIMETYPE, 'application/x-msgpack'])
+    if best is None or best == 'application/json':
+        return None
+    return 'msgpack'
+
+
+def to_msgpack(resp):
+    """Returns a new response whose body is the JSON body of *resp* encoded
+    in MessagePack. Other headers are kept.
+
+    """
+    data = json.loads(resp.get_data(as_text=True))
+    headers = [(k, v) for k, v in resp.headers
+               if k.lower() not in ('content-length', 'content-type')]
+    return Response(msgpack.packb(data, use_bin_type=True), headers=headers,
+                    mimetype=MSGPACK_MIMETYPE)
+
+
+def compress(data, encoding):
+    """Compresses *data* with the content coding *encoding*, which is either
+    ``"gzip"`` or ``"deflate"``.
+
+    """
+    compressobj = _compressobj(encoding)
+    return compressobj.compress(data) + compressobj.flush()
+
+
+def compress_iter(chunks, encoding):
+    """Same as :func:`compress` but compresses an iterable of byte strings
+    and yields compressed chunks as they become available.
+
+    """
+    compressobj = _compressobj(encoding)
+    for chunk in chunks:
+        data = compressobj.compress(chunk)
+        if data:
+            yield data
+    yield compressobj.flush()
+
+
+def _compressobj(encoding):
+    if encoding == 'gzip':
+        return zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        return zlib.compressobj(9)
+    raise ValueError('unsupported encoding: {0}'.format(encoding))
+
+
+def make_etag(version, encoding=None, variant=None):
+    """Returns the entity tag for *version*. Each compressed variant and each
+    format variant has its own entity tag.
+
+    """
+    return 'v{0}'.format(version) + ''.join(
+        '-' + x for x in (variant, encoding) if x is not None)
+
+
+def not_modified(version, created_at, encoding=None, variant=None):
+    """Returns ``True`` if the current request is conditional and the client
+    already has the representation of *version*. ``If-None-Match`` takes
+    precedence over ``If-Modified-Since``.
+
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(
+            make_etag(version, encoding, variant))
+    if request.if_modified_since and created_at is not None:
+        return request.if_modified_since >= created_at.replace(microsecond=0)
+    return False
+
+
+def set_validators(resp, version, created_at, encoding=None, variant=None):
+    """Sets a strong ``ETag`` and ``Last-Modified`` for *version* on *resp*.
+    ``Cache-Control: no-cache`` is also set so that clients revalidate their
+    copy on each use and see new data right after an update.
+
+    """
+    resp.set_etag(make_etag(version, encoding, variant))
+    if created_at is not None:
+        resp.last_modified = created_at
+    resp.cache_control.no_cache = True
+
+
+def build_snapshots(version):
+    """Renders the snapshots of all endpoints decorated with :func:`snapshot`
+    that take no URL arguments and don't require query parameters, for
+    *version*.
+
+    """
+    app = current_app._get_current_object()
+    for rule in app.url_map.iter_rules():
+        view = app.view_functions[rule.endpoint]
+        render = getattr(view, 'render_snapshot', None)
+        if render is None or rule.arguments:
+            continue
+        query_args = getattr(view, 'snapshot_query_args', None)
+        if query_args is not None:
+            try:
+                query_args(MultiDict())
+            except ValueError:
+                continue
+        with app.test_request_context(rule.rule):
+            render(version)
@@ -7,24 +7,70 @@
 
 """
 
+import base64
 from datetime import timedelta
 from functools import update_wrapper
+import math
 
-from flask import (Blueprint, Response, jsonify, make_response, request,
-                   current_app)
+from flask import (Blueprint, Response, json, jsonify, make_response,
+                   request, current_app, stream_with_context)
 try:
     import heroku
 except ImportError:
     heroku = None
 
-from ._compat import text_type, string_types, total_seconds
+from ._compat import (OrderedDict, text_type, string_types, iteritems,
+                      to_native, total_seconds)
+from .changes import get_changes
 from .crawler import is_update_needed, update_data
 from .extensions import db, cache, update_queue
+from .frontier import get_frontier
+from .interpolation import (GRID_NOISE_LEVELS, GRID_CPU_POWER, get_grids,
+                            interpolate)
 from .models import Maker, Heatsink, FanConfig, Measurement
+from .rankings import get_rankings
+from .scoring import SCORE_COLUMNS, get_scores, scores_of, to_list
+from .snapshots import get_data_version, snapshot
 
 
 views = Blueprint('views', __name__)
 
+#: Query parameters accepted by :func:`measurements` and their types.
+MEASUREMENT_FILTERS = [
+    ('noise', int),
+    ('power', int),
+    ('maker', text_type),
+    ('heatsink_type', text_type),
+    ('fan_size', int),
+    ('fan_count', int),
+    ('cpu_temp_delta_min', float),
+    ('cpu_temp_delta_max', float),
+    ('price_min', int),
+    ('price_max', int),
+]
+
+#: Query parameters accepted by :func:`frontier` as filters and their types.
+FRONTIER_FILTERS = [
+    ('maker', text_type),
+    ('heatsink_type', text_type),
+    ('fan_size', int),
+    ('fan_count', int),
+    ('price_max', int),
+]
+
+#: The number of items in a page if ``after`` is given without ``limit``.
+PAGE_LIMIT = 100
+
+#: The maximum value of ``limit``.
+MAX_PAGE_LIMIT = 1000
+
+#: The default number of items returned by :func:`rankings`.
+RANKING_LIMIT = 10
+
+#: The number of rows fetched from the database at a time and written as one
+#: chunk during export.
+EXPORT_BATCH_SIZE = 1000
+
 
 def crossdomain(origin=None, methods=None, headers=None,
                 max_age=86400 * 30, attach_to_all=True,
@@ -98,9 +144,135 @@ def crossdomain(origin=None, methods=None, headers=None,
     return decorator
 
 
+def parse_page_args(args):
+    """Returns a list of ``(name, value)`` pairs of the pagination
+    parameters ``after`` and ``limit`` in *args*, a mapping of query
+    parameters. If neither is given, the list is empty and the response is
+    not paginated. Raises :exc:`ValueError` if a value is invalid.
+
+    """
+    page = []
+    for name, min_value, max_value in (('after', 0, None),
+                                       ('limit', 1, MAX_PAGE_LIMIT)):
+        value = args.get(name)
+        if value is None:
+            continue
+        try:
+            value = int(value)
+        except ValueError:
+            value = None
+        if (value is None or value < min_value or
+                (max_value is not None and value > max_value)):
+            raise ValueError('invalid value for {0}: {1}'.format(
+                name, args[name]))
+        page.append((name, value))
+    if page and 'limit' not in args:
+        page.append(('limit', PAGE_LIMIT))
+    return page
+
+
+def parse_format_args(args):
+    """Returns a list containing a ``(name, value)`` pair of the ``format``
+    parameter in *args*, a mapping of query parameters, or an empty list if
+    it is not given. The only valid value is ``columnar``. Raises
+    :exc:`ValueError` if the value is invalid.
+
+    """
+    if 'format' not in args:
+        return []
+    if args['format'] != 'columnar':
+        raise ValueError('invalid value for format: {0}'.format(
+            args['format']))
+    return [('format', 'columnar')]
+
+
+def parse_list_args(args):
+    """Returns :func:`parse_page_args` and :func:`parse_format_args`
+    combined, sorted by name.
+
+    """
+    return sorted(parse_page_args(args) + parse_format_args(args))
+
+
+def list_response(query, model, list_args, sort_key=None):
+    """Returns a JSON response of the instances of *model* selected by
+    *query*. *list_args* is a mapping returned by :func:`parse_list_args`.
+
+    If the response is paginated, items are ordered by their *id* and the
+    response has the *next* property in addition to *count* and *items*,
+    which is the value of ``after`` for the next page, or ``null`` if it is
+    the last page. Otherwise all items are returned, sorted by *sort_key* if
+    it is given. *sort_key* takes a mapping of the columns of an item.
+
+    If ``format`` is ``columnar``, the response has *columns* and *nulls*
+    instead of *items*. See :func:`columnar` for details.
+
+    """
+    limit = list_args.get('limit')
+    if limit is not None:
+        query = query.order_by(model.id)
+        if 'after' in list_args:
+            query = query.filter(model.id > list_args['after'])
+        query = query.limit(limit + 1)
+        sort_key = None
+    extra = {}
+    if list_args.get('format') == 'columnar':
+        columns = query.all_as_columns()
+        count = len(columns['id'])
+        if limit is not None:
+            extra['next'] = columns['id'][limit - 1] if count > limit else None
+            count = min(count, limit)
+            for values in columns.values():
+                del values[count:]
+        if sort_key is not None:
+            # Rows are ordered the same as items, which sort_key takes.
+            names = list(columns)
+            order = sorted(range(count), key=lambda i: sort_key(
+                dict((name, columns[name][i]) for name in names)))
+            for name in names:
+                values = columns[name]
+                columns[name] = [values[i] for i in order]
+        extra.update(columnar(columns))
+        return jsonify(count=count, **extra)
+    items = query.all_as_dict()
+    if limit is not None:
+        extra['next'] = items[limit - 1]['id'] if len(items) > limit else None
+        del items[limit:]
+    if sort_key is not None:
+        items.sort(key=sort_key)
+    return jsonify(count=len(items), items=items, **extra)
+
+
+def columnar(columns):
+    """Encodes *columns*, a mapping of column names to lists of values, in
+    the columnar format. Returns a dictionary with two keys:
+
+    - *columns* maps each column name to a list of the values of the column
+      with nulls left out.
+    - *nulls* maps the name of each column that has nulls to a bitmap of
+      nulls. It is a Base64-encoded string in which the bit
+      ``1 << (i % 8)`` of the byte ``i // 8`` is set if the value of the
+      ``i``-th item is null.
+
+    """
+    encoded = {}
+    nulls = {}
+    for name, values in iteritems(columns):
+        if None not in values:
+            encoded[name] = values
+            continue
+        bitmap = bytearray((len(values) + 7) // 8)
+        for i, value in enumerate(values):
+            if value is None:
+                bitmap[i // 8] |= 1 << (i % 8)
+        encoded[name] = [value for value in values if value is not None]
+        nulls[name] = to_native(base64.b64encode(bytes(bitmap)))
+    return {'columns': encoded, 'nulls': nulls}
+
+
 @views.route('/makers')
 @crossdomain()
-@cache.cached()
+@snapshot
 def makers():
     """Returns all heatsink makers. CORS enabled.
 
@@ -150,7 +322,7 @@ def makers():
 
 @views.route('/heatsinks')
 @crossdomain()
-@cache.cached()
+@snapshot(query_args=parse_list_args)
 def heatsinks():
     """Returns all heatsink models. CORS enabled.
 
@@ -212,15 +384,22 @@ def heatsinks():
     image_url*     string  URL of the photo of the heatsink
     =============  ======  ====================================================
 
+    :query limit: the number of items in a page (see :ref:`pagination`)
+    :query after: return items whose *id* is greater than this value
+    :query format: ``columnar`` to get the items column by column (see
+                   :ref:`columnar-format`)
+    :status 200: no error
+    :status 400: a query parameter has an invalid value
+
     """
-    items = Heatsink.query.all_as_dict()
-    items.sort(key=lambda data: data['name'].lower())
-    return jsonify(count=len(items), items=items)
+    return list_response(Heatsink.query, Heatsink,
+                         dict(parse_list_args(request.args)),
+                         sort_key=lambda data: data['name'].lower())
 
 
 @views.route('/fan-configs')
 @crossdomain()
-@cache.cached()
+@snapshot(query_args=parse_list_args)
 def fan_configs():
     """Returns all fan configs, combinations of a heatsink and one or more
     fans. CORS enabled.
@@ -274,16 +453,82 @@ def fan_configs():
     fan_thickness    number  The thickness of a fan in mm
     ===============  ======  ==================================================
 
+    :query limit: the number of items in a page (see :ref:`pagination`)
+    :query after: return items whose *id* is greater than this value
+    :query format: ``columnar`` to get the items column by column (see
+                   :ref:`columnar-format`)
+    :status 200: no error
+    :status 400: a query parameter has an invalid value
+
     """
-    items = FanConfig.query.all_as_dict()
-    return jsonify(count=len(items), items=items)
+    return list_response(FanConfig.query, FanConfig,
+                         dict(parse_list_args(request.args)))
+
+
+def parse_measurement_filters(args):
+    """Returns a list of ``(name, value)`` pairs of the filters in *args*,
+    a mapping of query parameters, sorted by name. Unknown parameters are
+    ignored and values are converted to the types in
+    :data:`MEASUREMENT_FILTERS`. Raises :exc:`ValueError` if a value cannot
+    be converted.
+
+    """
+    filters = []
+    for name, type_ in MEASUREMENT_FILTERS:
+        value = args.get(name)
+        if value is None:
+            continue
+        try:
+            filters.append((name, type_(value)))
+        except ValueError:
+            raise ValueError('invalid value for {0}: {1}'.format(name, value))
+    filters.sort()
+    return filters
+
+
+def filter_measurements(query, filters):
+    """Applies *filters*, a mapping of the names in
+    :data:`MEASUREMENT_FILTERS` to values, to *query*, a query that selects
+    :class:`~cpucoolerchart.models.Measurement`.
+
+    """
+    heatsink_filters = set(['maker', 'heatsink_type', 'price_min',
+                            'price_max']) & set(filters)
+    fan_config_filters = set(['fan_size', 'fan_count']) & set(filters)
+    if heatsink_filters or fan_config_filters:
+        query = query.join(FanConfig,
+                           FanConfig.id == Measurement.fan_config_id)
+    if heatsink_filters:
+        query = query.join(Heatsink, Heatsink.id == FanConfig.heatsink_id)
+    if 'maker' in filters:
+        query = query.join(Maker, Maker.id == Heatsink.maker_id)
+        query = query.filter(Maker.name == filters['maker'])
+    for column in (Measurement.noise, Measurement.power, FanConfig.fan_size,
+                   FanConfig.fan_count, Heatsink.heatsink_type):
+        if column.key in filters:
+            query = query.filter(column == filters[column.key])
+    for column in (Measurement.cpu_temp_delta, Heatsink.price):
+        if column.key + '_min' in filters:
+            query = query.filter(column >= filters[column.key + '_min'])
+        if column.key + '_max' in filters:
+            query = query.filter(column <= filters[column.key + '_max'])
+    return query
+
+
+def parse_measurement_args(args):
+    """Returns :func:`parse_measurement_filters` and :func:`parse_list_args`
+    combined, sorted by name.
+
+    """
+    return sorted(parse_measurement_filters(args) + parse_list_args(args))
 
 
 @views.route('/measurements')
 @crossdomain()
-@cache.cached()
+@snapshot(query_args=parse_measurement_args)
 def measurements():
-    """Returns all measurement data. CORS enabled.
+    """Returns all measurement data, or the measurement data that match the
+    filters given as query parameters. CORS enabled.
 
     **Example request**:
 
@@ -344,13 +589,608 @@ def measurements():
     power_temp_delta*   number  Power temperature in °C
     ==================  ======  ===============================================
 
+    :query noise: target noise level in dB
+    :query power: target CPU power consumption in watt
+    :query maker: name of the maker of the heatsink
+    :query heatsink_type: type of the heatsink (flower or tower)
+    :query fan_size: the diameter of a fan in mm
+    :query fan_count: number of fans
+    :query cpu_temp_delta_min: minimum CPU temperature in °C
+    :query cpu_temp_delta_max: maximum CPU temperature in °C
+    :query price_min: minimum price of the heatsink in KRW
+    :query price_max: maximum price of the heatsink in KRW. Heatsinks whose
+                      price is unknown are excluded if either of *price_min*
+                      or *price_max* is given.
+    :query limit: the number of items in a page (see :ref:`pagination`)
+    :query after: return items whose *id* is greater than this value
+    :query format: ``columnar`` to get the items column by column (see
+                   :ref:`columnar-format`)
+    :status 200: no error
+    :status 400: a query parameter has an invalid value
+
+    """
+    filters = dict(parse_measurement_filters(request.args))
+    query = filter_measurements(Measurement.query, filters)
+    return list_response(query, Measurement,
+                         dict(parse_list_args(request.args)))
+
+
+#: The levels of the document returned by :func:`chart`. Each level is a
+#: tuple of a model, the name of the property containing the items of the next
+#: level, and the foreign key to the previous level, which is left out.
+CHART_LEVELS = [
+    (Maker, 'heatsinks', None),
+    (Heatsink, 'fan_configs', 'maker_id'),
+    (FanConfig, 'measurements', 'heatsink_id'),
+    (Measurement, None, 'fan_config_id'),
+]
+
+
+@views.route('/chart')
+@crossdomain()
+@snapshot
+def chart():
+    """Returns all data as a single document, in which makers contain their
+    heatsinks, heatsinks contain their fan configs, and fan configs contain
+    their measurements. It is equivalent to joining the results of
+    :func:`makers`, :func:`heatsinks`, :func:`fan_configs` and
+    :func:`measurements` by *id*, but is retrieved in one request and built
+    with one SQL query. CORS enabled.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+       GET /chart HTTP/1.1
+       Host: example.com
+       Accept: application/json
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+         "count": 1,
+         "items": [
+           {
+             "id": 1,
+             "name": "3Rsystem",
+             "heatsinks": [
+               {
+                 "id": 1,
+                 "name": "iCEAGE 120",
+                 "heatsink_type": "tower",
+                 ...,
+                 "fan_configs": [
+                   {
+                     "id": 1,
+                     "fan_count": 1,
+                     "fan_size": 120,
+                     "fan_thickness": 25,
+                     "measurements": [
+                       {
+                         "id": 1,
+                         "noise": 35,
+                         "power": 62,
+                         "cpu_temp_delta": 50.7,
+                         ...
+                       }
+                     ]
+                   }
+                 ]
+               }
+             ]
+           }
+         ]
+       }
+
+    Items have the same properties as the items of the other endpoints,
+    except that the *id* of the containing item (*maker_id*, *heatsink_id*
+    and *fan_config_id*) is left out. *count* is the number of makers. Makers,
+    heatsinks and fan configs without measurements are included with an
+    empty array. Unlike the other endpoints, the document is never
+    pretty-printed.
+
+    """
+    columns = []
+    levels = []
+    for model, children_key, parent_key in CHART_LEVELS:
+        names = [name for name in model.__table__.columns.keys()
+                 if name != parent_key]
+        levels.append((names, len(columns), children_key))
+        columns.extend(getattr(model, name) for name in names)
+    rows = db.session.query(*columns).select_from(Maker).outerjoin(
+        Heatsink, Heatsink.maker_id == Maker.id).outerjoin(
+        FanConfig, FanConfig.heatsink_id == Heatsink.id).outerjoin(
+        Measurement, Measurement.fan_config_id == FanConfig.id).order_by(
+        Maker.name, Heatsink.name, Heatsink.id, FanConfig.fan_size,
+        FanConfig.fan_thickness, FanConfig.fan_count, FanConfig.id,
+        Measurement.noise, Measurement.power)
+
+    # Rows of the same item are adjacent, so an item is complete when a row of
+    # another item at the same level appears.
+    items = []
+    current = [None] * len(levels)
+    for row in rows:
+        container = items
+        for i, (names, start, children_key) in enumerate(levels):
+            values = row[start:start + len(names)]
+            if values[0] is None:
+                break
+            item = current[i]
+            if item is None or item['id'] != values[0]:
+                item = dict(zip(names, values))
+                if children_key is not None:
+                    item[children_key] = []
+                container.append(item)
+                current[i] = item
+            container = item.get(children_key)
+    return Response(json.dumps(dict(count=len(items), items=items),
+                               separators=(',', ':')),
+                    mimetype='application/json')
+
+
+def parse_ranking_args(args):
+    """Returns a list of ``(name, value)`` pairs of the query parameters of
+    :func:`rankings` in *args*, a mapping of query parameters, sorted by
+    name. Raises :exc:`ValueError` if a parameter is missing or invalid.
+
+    """
+    ranking_args = []
+    for name in ('noise', 'power', 'limit', 'price_max', 'heatsink_id'):
+        value = args.get(name)
+        if value is None:
+            if name in ('noise', 'power'):
+                raise ValueError('{0} is required'.format(name))
+            continue
+        try:
+            value = int(value)
+        except ValueError:
+            value = None
+        if value is None or value < (1 if name == 'limit' else 0) or (
+                name == 'limit' and value > MAX_PAGE_LIMIT):
+            raise ValueError('invalid value for {0}: {1}'.format(
+                name, args[name]))
+        ranking_args.append((name, value))
+    names = [name for name, value in ranking_args]
+    if 'heatsink_id' in names and ('limit' in names or
+                                   'price_max' in names):
+        raise ValueError('heatsink_id cannot be used with limit or price_max')
+    ranking_args.sort()
+    return ranking_args
+
+
+@views.route('/rankings')
+@crossdomain()
+@snapshot(query_args=parse_ranking_args)
+def rankings():
+    """Returns the fan configs with the lowest CPU temperature at a noise
+    level and a CPU power consumption, or the rank of a heatsink. The
+    rankings are built once after each update, so a query does not sort
+    measurements. CORS enabled.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+       GET /rankings?noise=40&power=150&limit=2&price_max=50000 HTTP/1.1
+       Host: example.com
+       Accept: application/json
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+         "noise": 40,
+         "power": 150,
+         "total": 25,
+         "count": 2,
+         "items": [
+           {
+             "rank": 3,
+             "measurement_id": 120,
+             "fan_config_id": 14,
+             "heatsink_id": 12,
+             "cpu_temp_delta": 51.2,
+             "price": 42000
+           },
+           {
+             "rank": 5,
+             "measurement_id": 75,
+             "fan_config_id": 9,
+             "heatsink_id": 8,
+             "cpu_temp_delta": 52.9,
+             "price": 39800
+           }
+         ]
+       }
+
+    *total* is the number of fan configs measured at the noise level and CPU
+    power consumption. *rank* of an item is its rank among all of them, and
+    items having the same CPU temperature have the same rank.
+
+    :query noise: target noise level in dB (required)
+    :query power: target CPU power consumption in watt (required)
+    :query limit: the maximum number of items. Default is 10.
+    :query price_max: only include heatsinks whose price is known and not
+                      higher than this value in KRW
+    :query heatsink_id: return only the best fan config of this heatsink.
+                        Cannot be used with *limit* and *price_max*.
+    :status 200: no error
+    :status 400: a query parameter is missing or invalid
+
+    """
+    args = dict(parse_ranking_args(request.args))
+    ranking = get_rankings().get((args['noise'], args['power']))
+    if ranking is None:
+        indices = []
+    elif 'heatsink_id' in args:
+        index = ranking.heatsink_index(args['heatsink_id'])
+        indices = [] if index is None else [index]
+    else:
+        indices = ranking.top(args.get('limit', RANKING_LIMIT),
+                              args.get('price_max'))
+    items = [ranking.as_dict(i) for i in indices]
+    return jsonify(noise=args['noise'], power=args['power'],
+                   total=len(ranking) if ranking is not None else 0,
+                   count=len(items), items=items)
+
+
+@views.route('/scores')
+@crossdomain()
+@snapshot(query_args=parse_format_args)
+def scores():
+    """Returns metrics derived from all measurement data. The metrics are
+    computed for the whole data set at once after each update. This feature
+    requires NumPy. CORS enabled.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+       GET /scores HTTP/1.1
+       Host: example.com
+       Accept: application/json
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+         "count": 1,
+         "items": [
+           {
+             "measurement_id": 1,
+             "headroom": 12.4,
+             "headroom_per_10k_krw": 2.1017,
+             "score": 1.248
+           }
+         ]
+       }
+
+
+    **Properties**:
+
+    ====================  ======  =============================================
+    name                  type    description
+    ====================  ======  =============================================
+    measurement_id        number  *id* of the corresponding measurement
+    headroom              number  How much cooler the CPU is in °C than with
+                                  the worst fan config measured at the same
+                                  noise level and CPU power consumption
+    headroom_per_10k_krw* number  *headroom* per 10,000 KRW of the price of
+                                  the heatsink
+    score                 number  The number of standard deviations by which
+                                  the CPU temperature is lower than the
+                                  average at the same noise level and CPU
+                                  power consumption. It can be compared
+                                  across noise levels.
+    ====================  ======  =============================================
+
+    :query format: ``columnar`` to get the items column by column (see
+                   :ref:`columnar-format`)
+    :status 200: no error
+    :status 400: a query parameter has an invalid value
+    :status 503: NumPy is not installed
+
+    """
+    arrays = get_scores()
+    if arrays is None:
+        return jsonify(msg='numpy is not installed'), 503
+    names = ['measurement_id'] + SCORE_COLUMNS
+    columns = OrderedDict((name, to_list(arrays[name])) for name in names)
+    if parse_format_args(request.args):
+        return jsonify(count=len(columns['measurement_id']),
+                       **columnar(columns))
+    items = [dict(zip(names, values)) for values in zip(*columns.values())]
+    return jsonify(count=len(items), items=items)
+
+
+def parse_estimate_args(args):
+    """Returns a list of ``(name, value)`` pairs of the query parameters of
+    :func:`estimates` in *args*, a mapping of query parameters, sorted by
+    name and value. Raises :exc:`ValueError` if a parameter is missing or
+    invalid.
+
+    """
+    estimate_args = []
+    for name, axis in (('noise', GRID_NOISE_LEVELS),
+                       ('power', GRID_CPU_POWER)):
+        value = args.get(name)
+        if value is None:
+            raise ValueError('{0} is required'.format(name))
+        try:
+            value = float(value)
+        except ValueError:
+            value = None
+        if value is None or not axis[0] <= value <= axis[-1]:
+            raise ValueError('invalid value for {0}: {1}'.format(
+                name, args[name]))
+        estimate_args.append((name, value))
+    for value in args.getlist('fan_config_id'):
+        try:
+            estimate_args.append(('fan_config_id', int(value)))
+        except ValueError:
+            raise ValueError('invalid value for fan_config_id: {0}'.format(
+                value))
+    estimate_args.sort()
+    return estimate_args
+
+
+@views.route('/estimates')
+@crossdomain()
+@snapshot(query_args=parse_estimate_args)
+def estimates():
+    """Returns the estimated CPU temperatures of fan configs at a noise
+    level and a CPU power consumption that may lie between those at which
+    the measurements are taken, sorted by *cpu_temp_delta* in ascending
+    order. Estimates are interpolated bilinearly from the four surrounding
+    measurements of each fan config; fan configs missing any of them are
+    left out. This feature requires NumPy. CORS enabled.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+       GET /estimates?noise=38&power=120 HTTP/1.1
+       Host: example.com
+       Accept: application/json
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+         "count": 1,
+         "items": [
+           {
+             "fan_config_id": 152,
+             "cpu_temp_delta": 43.2
+           }
+         ]
+       }
+
+    :query noise: noise level in dB, from 35 to 45 (required)
+    :query power: CPU power consumption in watt, from 62 to 200 (required)
+    :query fan_config_id: *id* of a fan config to estimate. Can be given
+                          multiple times. All fan configs by default.
+    :status 200: no error
+    :status 400: a query parameter is missing or invalid
+    :status 503: NumPy is not installed
+
+    """
+    grids = get_grids()
+    if grids is None:
+        return jsonify(msg='numpy is not installed'), 503
+    estimate_args = parse_estimate_args(request.args)
+    fan_config_ids = [value for name, value in estimate_args
+                      if name == 'fan_config_id']
+    if not fan_config_ids:
+        fan_config_ids = grids['fan_config_id']
+    estimate_args = dict(estimate_args)
+    values = interpolate(grids, fan_config_ids, estimate_args['noise'],
+                         estimate_args['power'])
+    items = [{'fan_config_id': int(fan_config_id),
+              'cpu_temp_delta': round(float(value), 1)}
+             for fan_config_id, value in zip(fan_config_ids, values)
+             if not math.isnan(value)]
+    items.sort(key=lambda item: (item['cpu_temp_delta'],
+                                 item['fan_config_id']))
+    return jsonify(count=len(items), items=items)
+
+
+def parse_frontier_args(args):
+    """Returns a list of ``(name, value)`` pairs of the query parameters of
+    :func:`frontier` in *args*, a mapping of query parameters, sorted by
+    name. Raises :exc:`ValueError` if a parameter is missing or invalid.
+
+    """
+    if 'power' not in args:
+        raise ValueError('power is required')
+    frontier_args = []
+    for name, type_ in [('power', int)] + FRONTIER_FILTERS:
+        value = args.get(name)
+        if value is None:
+            continue
+        try:
+            frontier_args.append((name, type_(value)))
+        except ValueError:
+            raise ValueError('invalid value for {0}: {1}'.format(name, value))
+    frontier_args.sort()
+    return frontier_args
+
+
+@views.route('/frontier')
+@crossdomain()
+@snapshot(query_args=parse_frontier_args)
+def frontier():
+    """Returns the measurements at a CPU power consumption that are not
+    dominated by any other on noise, CPU temperature and price, i.e. there
+    is no other measurement that is at least as good in all three and better
+    in one of them. Measurements of heatsinks without a price are left out.
+    Items are sorted by *noise*, *cpu_temp_delta* and *price*. The frontier
+    without filters is computed once after each update. CORS enabled.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+       GET /frontier?power=150&fan_size=120 HTTP/1.1
+       Host: example.com
+       Accept: application/json
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+         "count": 1,
+         "items": [
+           {
+             "measurement_id": 1620,
+             "fan_config_id": 152,
+             "heatsink_id": 97,
+             "noise": 35,
+             "cpu_temp_delta": 50.1,
+             "price": 35000
+           }
+         ]
+       }
+
+    :query power: CPU power consumption in watt (required)
+    :query maker: maker name
+    :query heatsink_type: ``flower`` or ``tower``
+    :query fan_size: fan size in mm
+    :query fan_count: number of fans
+    :query price_max: maximum price of the heatsink in KRW
+    :status 200: no error
+    :status 400: a query parameter is missing or invalid
+
     """
-    items = Measurement.query.all_as_dict()
+    frontier_args = dict(parse_frontier_args(request.args))
+    points = get_frontier(**frontier_args)
+    items = [{
+        'measurement_id': point.measurement_id,
+        'fan_config_id': point.fan_config_id,
+        'heatsink_id': point.heatsink_id,
+        'noise': point.noise,
+        'cpu_temp_delta': point.cpu_temp_delta,
+        'price': point.price,
+    } for point in points]
     return jsonify(count=len(items), items=items)
 
 
-def export_data(delim=','):
-    """Returns all data in CSV format."""
+def parse_changes_args(args):
+    """Returns a list containing a ``(name, value)`` pair of the ``since``
+    parameter in *args*, a mapping of query parameters. Raises
+    :exc:`ValueError` if it is missing or invalid.
+
+    """
+    since = args.get('since')
+    if since is None:
+        raise ValueError('since is required')
+    try:
+        value = int(since)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise ValueError('invalid value for since: {0}'.format(since))
+    return [('since', value)]
+
+
+@views.route('/changes')
+@crossdomain()
+@snapshot(query_args=parse_changes_args)
+def changes():
+    """Returns the changes made to the data since a version, so that clients
+    keeping a copy of the data can update it without downloading all data.
+    The current version is the *version* property of the response, and is
+    also found in the ``ETag`` of the other endpoints. CORS enabled.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+       GET /changes?since=41 HTTP/1.1
+       Host: example.com
+       Accept: application/json
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+         "version": 42,
+         "resync": false,
+         "changes": {
+           "makers": {"upserted": [], "deleted": []},
+           "heatsinks": {
+             "upserted": [
+               {
+                 "id": 46,
+                 "name": "H100",
+                 "price": 179000,
+                 ...
+               }
+             ],
+             "deleted": []
+           },
+           "fan_configs": {"upserted": [], "deleted": []},
+           "measurements": {"upserted": [], "deleted": [1021, 1022]}
+         }
+       }
+
+    *changes* has a property for each of makers, heatsinks, fan configs and
+    measurements. *upserted* is a list of items inserted or updated since
+    the version, with the same properties as the items of the corresponding
+    endpoint. *deleted* is a list of the *id* of items deleted since the
+    version. Changes of several versions are merged, so an item appears only
+    once.
+
+    Changes are kept for the last ``CHANGES_RETENTION`` versions. If the
+    changes since the version are no longer available, *resync* is ``true``
+    and there is no *changes* property. The client should then download all
+    data again.
+
+    :query since: the version of the data that the client has, or ``0`` if
+                  it has nothing
+    :status 200: no error
+    :status 400: *since* is missing or invalid
+
+    """
+    since = dict(parse_changes_args(request.args))['since']
+    return jsonify(**get_changes(since, get_data_version()[0]))
+
+
+def iter_export_data(delim=',', batch_size=EXPORT_BATCH_SIZE, scores=None):
+    """Yields all data in CSV format in chunks. Rows are fetched from the
+    database *batch_size* rows at a time and each batch is yielded as one
+    chunk, so that the whole data is never held in memory at once.
+
+    If *scores*, the arrays returned by
+    :func:`~cpucoolerchart.scoring.get_scores`, is given, the columns in
+    :data:`~cpucoolerchart.scoring.SCORE_COLUMNS` are appended.
+
+    """
     columns = [
         Maker.name, Heatsink.name, Heatsink.width, Heatsink.depth,
         Heatsink.height, Heatsink.heatsink_type, Heatsink.weight,
@@ -368,6 +1208,9 @@ def export_data(delim=','):
         'noise_actual_max', 'rpm_min', 'rpm_max', 'power', 'cpu_temp_delta',
         'power_temp_delta',
     ]
+    if scores is not None:
+        columns.append(Measurement.id)
+        column_names.extend(SCORE_COLUMNS)
     rows = db.session.query(*columns).select_from(Measurement).join(
         FanConfig, FanConfig.id == Measurement.fan_config_id).join(
         Heatsink, Heatsink.id == FanConfig.heatsink_id).join(
@@ -381,17 +1224,51 @@ def export_data(delim=','):
             return ''
         return text_type(x).replace(delim, '_' if delim != '_' else '-')
 
-    temp = []
-    temp.append(delim.join(column_names))
-    for row in rows:
-        temp.append(delim.join(convert(x) for x in row))
-    return '\n'.join(temp)
+    def format_batch(batch):
+        if scores is not None:
+            extra = scores_of(scores, [row[-1] for row in batch])
+            batch = [tuple(row[:-1]) + values
+                     for row, values in zip(batch, extra)]
+        return ''.join('\n' + delim.join(convert(x) for x in row)
+                       for row in batch)
+
+    yield text_type(delim.join(column_names))
+    batch = []
+    for row in rows.yield_per(batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield format_batch(batch)
+            batch = []
+    if batch:
+        yield format_batch(batch)
+
+
+def export_data(delim=',', scores=None):
+    """Returns all data in CSV format. See :func:`iter_export_data` for
+    a streaming version.
+
+    """
+    return ''.join(iter_export_data(delim, scores=scores))
+
+
+def parse_export_args(args):
+    """Returns a list containing a ``(name, value)`` pair of the ``scores``
+    parameter in *args*, a mapping of query parameters, if it is ``1``.
+    Raises :exc:`ValueError` if the value is neither ``0`` nor ``1``.
+
+    """
+    value = args.get('scores', '0')
+    if value not in ('0', '1'):
+        raise ValueError('invalid value for scores: {0}'.format(value))
+    return [('scores', 1)] if value == '1' else []
 
 
 @views.route('/all')
-@cache.cached()
+@snapshot(query_args=parse_export_args, mimetype='text/csv')
 def all():
-    """Returns all data in CSV format.
+    """Returns all data in CSV format. Rows are read from the database in
+    batches and the response is streamed as they are read. It is rendered
+    once for each data version and served from a snapshot afterwards.
 
     **Example request**:
 
@@ -414,7 +1291,13 @@ def all():
        Zalman,ZM-LQ320,,,,tower,195.0,91000,244,2013-01-31 16:57:18,120,25,2,100,58,58,2042,2068,200,60.8,64.5
 
     """
-    resp = Response(export_data(), mimetype='text/csv')
+    scores = None
+    if parse_export_args(request.args):
+        scores = get_scores()
+        if scores is None:
+            return jsonify(msg='numpy is not installed'), 503
+    resp = Response(stream_with_context(iter_export_data(scores=scores)),
+                    mimetype='text/csv')
     resp.headers['Content-Disposition'] = 'filename="cooler.csv"'
     return resp
 
@@ -75,12 +75,20 @@ setup(
     long_description=readme(),
     packages=['cpucoolerchart'],
     install_requires=install_requires,
+    extras_require={
+        'lz4': ['lz4 == 0.7.0'],
+        'msgpack': ['msgpack-python == 0.4.1'],
+        'numpy': ['numpy == 1.8.0'],
+        'zstd': ['zstandard == 0.8.1'],
+    },
     tests_require=[
         'pytest == 2.5.2',
         'pytest-cov == 1.6',
         'pytest-pep8 == 1.0.5',
         'mock == 1.0.1',
         'fakeredis-fix == 0.4.1',
+        'msgpack-python == 0.4.1',
+        'numpy == 1.8.0',
     ],
     cmdclass={'test': pytest},
     entry_points={
@@ -0,0 +1,125 @@
+from mock import patch
+
+from cpucoolerchart import crawler
+from cpucoolerchart.changes import get_changes
+from cpucoolerchart.extensions import db
+from cpucoolerchart.models import (Maker, Heatsink, FanConfig, Measurement,
+                                   Changeset, RowChange, DataVersion)
+
+from .conftest import get_json
+
+
+def test_record_changes(db):
+    crawler.update_data()
+    assert Changeset.query.count() == 1
+    assert RowChange.query.filter_by(action='insert').count() == (
+        Maker.query.count() + Heatsink.query.count() +
+        FanConfig.query.count() + Measurement.query.count())
+
+    heatsink = Heatsink.query.first()
+    heatsink.price = 10000
+    measurement = Measurement.query.first()
+    db.session.delete(measurement)
+    db.session.commit()
+    crawler.update_data(force=True)
+    assert sorted((x.table_name, x.row_id, x.action) for x in
+                  RowChange.query.filter_by(version=2)) == [
+        ('heatsink', heatsink.id, 'update'),
+        ('measurement', measurement.id, 'delete'),
+    ]
+
+    with patch('cpucoolerchart.crawler.publish_data_version') as publish:
+        crawler.update_data(force=True)
+        assert not publish.called
+    assert Changeset.query.count() == 2
+    assert DataVersion.query.count() == 2
+
+
+def test_get_changes(db):
+    assert get_changes(0) == {'version': 0, 'resync': False, 'changes': {
+        'makers': {'upserted': [], 'deleted': []},
+        'heatsinks': {'upserted': [], 'deleted': []},
+        'fan_configs': {'upserted': [], 'deleted': []},
+        'measurements': {'upserted': [], 'deleted': []},
+    }}
+    crawler.update_data()
+    changes = get_changes(0)['changes']
+    assert len(changes['measurements']['upserted']) == 290
+
+    heatsink = Heatsink.query.first()
+    heatsink.price = 10000
+    db.session.commit()
+    crawler.update_data(force=True)
+    heatsink.price = 12000
+    measurement = Measurement.query.first()
+    db.session.delete(measurement)
+    db.session.commit()
+    crawler.update_data(force=True)
+
+    data = get_changes(1)
+    assert data['version'] == 3
+    assert not data['resync']
+    assert data['changes']['heatsinks'] == {
+        'upserted': [heatsink.as_dict()], 'deleted': []}
+    assert data['changes']['measurements'] == {
+        'upserted': [], 'deleted': [measurement.id]}
+    assert data['changes']['makers'] == {'upserted': [], 'deleted': []}
+    assert get_changes(1, 2)['changes']['measurements']['deleted'] == []
+    assert get_changes(3)['changes']['heatsinks']['upserted'] == []
+    assert get_changes(4)['resync']
+
+
+def test_get_changes_version_gap(db):
+    crawler.update_data()
+    heatsink = Heatsink.query.first()
+    heatsink.price = 10000
+    db.session.commit()
+    # Databases may not reuse the ids of rolled back versions.
+    with patch('cpucoolerchart.crawler.DataVersion',
+               lambda **kwargs: DataVersion(id=3, **kwargs)):
+        crawler.update_data(force=True)
+    assert [x.id for x in DataVersion.query.order_by(DataVersion.id)] == [
+        1, 3]
+    data = get_changes(1)
+    assert data['version'] == 3
+    assert not data['resync']
+    assert data['changes']['heatsinks']['upserted'] == [heatsink.as_dict()]
+    assert not get_changes(0)['resync']
+    assert not get_changes(2)['resync']
+
+
+def test_compact_changesets(app, db):
+    app.config['CHANGES_RETENTION'] = 2
+    for i in range(4):
+        crawler.update_data(force=True)
+        Heatsink.query.first().price = 10000 + i
+        db.session.commit()
+    assert [x.id for x in Changeset.query.order_by(Changeset.id)] == [3, 4]
+    assert RowChange.query.filter(RowChange.version <= 2).count() == 0
+    assert get_changes(1)['resync']
+    assert get_changes(0)['resync']
+    assert not get_changes(2)['resync']
+
+
+def test_changes_view(app, db):
+    client = app.test_client()
+    crawler.update_data()
+    heatsink = Heatsink.query.first()
+    heatsink.price = 10000
+    db.session.commit()
+    crawler.update_data(force=True)
+
+    data = get_json(client, '/changes?since=1')
+    assert data['version'] == 2
+    assert data['changes']['heatsinks']['upserted'][0]['price'] == 10000
+    r = client.get('/changes?since=1')
+    assert r.headers['ETag'] == '"v2"'
+    assert r.headers['Access-Control-Allow-Origin'] == '*'
+    assert get_json(client, '/changes?since=0')['changes']['makers'][
+        'upserted'][0]['name'] == Maker.query.get(1).name
+
+    assert get_json(client, '/changes', 400)['msg'] == 'since is required'
+    assert get_json(client, '/changes?since=-1', 400)['msg'] == (
+        'invalid value for since: -1')
+    assert get_json(client, '/changes?since=x', 400)['msg'] == (
+        'invalid value for since: x')
@@ -34,3 +34,12 @@ def test_export(db, capsys):
     export('\t')
     out, err = capsys.readouterr()
     assert to_bytes(out) == read_file('mock.tsv')
+
+
+def test_export_to_file(db, tmpdir, capsys):
+    fill_data()
+    path = tmpdir.join('cooler.tsv')
+    export('\t', output=str(path))
+    out, err = capsys.readouterr()
+    assert out == ''
+    assert path.read_binary() == read_file('mock.tsv')
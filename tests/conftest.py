@@ -1,12 +1,15 @@
 import io
+import json
 import os
 from tempfile import mkstemp
+import threading
 
 from fakeredis import FakeRedis
 from pytest import fixture
 from rq import Queue
 
-from cpucoolerchart._compat import to_bytes, http, urllib
+from cpucoolerchart._compat import (to_bytes, to_native, http, urllib,
+                                    socketserver)
 from cpucoolerchart.app import create_app
 from cpucoolerchart.extensions import db as flask_db
 import cpucoolerchart.extensions
@@ -56,6 +59,18 @@ def fill_data():
     flask_db.session.commit()
 
 
+def set_prices():
+    for heatsink in Heatsink.query:
+        heatsink.price = (heatsink.id % 7) * 5000 or None
+    flask_db.session.commit()
+
+
+def get_json(client, path, status_code=200):
+    r = client.get(path)
+    assert r.status_code == status_code
+    return json.loads(to_native(r.data))
+
+
 @fixture
 def app():
     app = create_app(test_settings)
@@ -75,6 +90,58 @@ def db(app, request):
     return flask_db
 
 
+class StandInHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Local HTTP server standing in for a remote source. Set :attr:`respond`
+    to a function that takes a request handler and returns a tuple of a status
+    code, a mapping of headers and a body.
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        http.server.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                        StandInRequestHandler)
+        self.respond = lambda handler: (404, {}, b'')
+        self.client_addresses = set()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+
+class StandInRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.client_addresses.add(self.client_address)
+        status, headers, body = self.server.respond(self)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@fixture
+def http_server(request):
+    server = StandInHTTPServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def fin():
+        server.shutdown()
+        server.server_close()
+    request.addfinalizer(fin)
+    return server
+
+
 @fixture(scope='session', autouse=True)
 def setup(request):
     def teardown():
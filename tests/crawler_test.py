@@ -1,5 +1,15 @@
+import json
+import os
+import sqlite3
+import time
+
+from mock import patch
+from sqlalchemy import event
+
 from cpucoolerchart import crawler
-from cpucoolerchart.models import Maker, Heatsink, FanConfig, Measurement
+from cpucoolerchart._compat import to_bytes, urllib
+from cpucoolerchart.models import (Maker, Heatsink, FanConfig, Measurement,
+                                   SourcePage, DataVersion)
 
 
 def test_dictitemgetter():
@@ -85,6 +95,34 @@ def xtest_fetch_measurement_data(db):
     }
 
 
+def test_fetch_measurement_data_concurrency(app, db):
+    app.config['CRAWLER_FETCH_CONCURRENCY'] = 1
+    sequential = crawler.fetch_measurement_data()
+    app.config['CRAWLER_FETCH_CONCURRENCY'] = 8
+    concurrent = crawler.fetch_measurement_data()
+    assert len(sequential) == 290
+    assert concurrent == sequential
+
+
+def test_fetch_measurement_data_failure(app, db):
+    get_page_html = crawler.get_page_html
+
+    def fail_on_one_page(noise, power):
+        if (noise, power) == (45, 92):
+            raise IOError('connection reset')
+        return get_page_html(noise, power)
+
+    app.config['CRAWLER_FETCH_CONCURRENCY'] = 4
+    with patch('cpucoolerchart.crawler.get_page_html', fail_on_one_page):
+        assert crawler.fetch_measurement_data() == []
+
+
+def test_map_concurrently(db):
+    result = crawler.map_concurrently(lambda x, y: x * y,
+                                      [(i, 2) for i in range(10)], 3)
+    assert result == [i * 2 for i in range(10)]
+
+
 def test_update_measurement_data(db):
     crawler.update_measurement_data([{
         'maker': 'Intel',
@@ -168,8 +206,225 @@ def test_update_measurement_data(db):
     ]
 
 
+def test_update_measurement_data_query_count(app, db):
+    data_list = crawler.fetch_measurement_data()
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        # The previous row-by-row synchronization issued 759 queries for
+        # the first update and 469 for an unchanged one.
+        crawler.update_measurement_data(data_list)
+        assert len(statements) <= 11
+        assert Measurement.query.count() == 290
+        del statements[:]
+        crawler.update_measurement_data(data_list)
+        assert len(statements) == 4
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
 def test_update_data(db):
     crawler.update_data()
     assert Maker.query.count() == 12
     assert Measurement.query.count() == 290
     assert Maker.query.get(1) == Maker(id=1, name='AMD')
+
+
+def test_update_data_failure(db):
+    crawler.update_data()
+    assert DataVersion.query.count() == 1
+    with patch('cpucoolerchart.crawler.fetch_measurement_pages',
+               return_value=None):
+        with patch('cpucoolerchart.crawler.publish_data_version') as publish:
+            crawler.update_data(force=True)
+            assert not publish.called
+    assert DataVersion.query.count() == 1
+
+
+def test_update_data_swap_database(app, db):
+    app.config['UPDATE_SWAP_DATABASE'] = True
+    path = db.get_engine(app).url.database
+    inode = os.stat(path).st_ino
+    update_measurement_data = crawler.update_measurement_data
+    live_counts = []
+
+    def check_live_database(*args, **kwargs):
+        update_measurement_data(*args, **kwargs)
+        conn = sqlite3.connect(path)
+        live_counts.append(
+            conn.execute('SELECT count(*) FROM measurement').fetchone()[0])
+        conn.close()
+
+    with patch('cpucoolerchart.crawler.update_measurement_data',
+               check_live_database):
+        crawler.update_data()
+    assert live_counts == [0]
+    assert os.stat(path).st_ino != inode
+    assert not os.path.exists(path + '.staging')
+    assert Maker.query.count() == 12
+    assert Measurement.query.count() == 290
+
+
+def test_update_data_swap_database_failure(app, db):
+    app.config['UPDATE_SWAP_DATABASE'] = True
+    path = db.get_engine(app).url.database
+    inode = os.stat(path).st_ino
+    with patch('cpucoolerchart.crawler.update_danawa_data',
+               side_effect=RuntimeError):
+        crawler.update_data()
+    assert os.stat(path).st_ino == inode
+    assert not os.path.exists(path + '.staging')
+    assert Measurement.query.count() == 0
+
+
+def test_do_update_data_unchanged_pages(db):
+    crawler.do_update_data()
+    assert SourcePage.query.count() == 14
+
+    with patch('cpucoolerchart.crawler.update_measurement_data') as update:
+        crawler.do_update_data()
+        assert update.call_count == 0
+
+    get_page_html = crawler.get_page_html
+
+    def change_one_page(noise, power):
+        html = get_page_html(noise, power)
+        if (noise, power) == (35, 62):
+            html = html.replace(b'<b>43.5<b>', b'<b>42.0<b>')
+        return html
+
+    with patch('cpucoolerchart.crawler.get_page_html', change_one_page):
+        with patch('cpucoolerchart.crawler.update_measurement_data',
+                   wraps=crawler.update_measurement_data) as update:
+            crawler.do_update_data()
+            assert update.call_count == 1
+    h110 = Heatsink.query.find(name='H110')
+    measurement = Measurement.query.join(FanConfig).filter(
+        FanConfig.heatsink_id == h110.id, Measurement.noise == 35,
+        Measurement.power == 62).one()
+    assert measurement.cpu_temp_delta == 42.0
+    assert Measurement.query.count() == 290
+
+
+def danawa_response(handler):
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(handler.path).query)
+    prod_code = int(query['prodCode'][0])
+    if prod_code == 999:
+        time.sleep(1)
+    body = json.dumps({
+        'minPrice': str(prod_code * 100),
+        'shopCount': '3',
+        'inputDate': '2013-01-31 16:57:18',
+        'images': {'image': [
+            {'name': 'large_1', 'url': 'http://img/{0}.jpg'.format(prod_code)},
+        ]},
+    })
+    return 200, {'Content-Type': 'application/json'}, to_bytes(body)
+
+
+def test_update_danawa_data(app, db, http_server):
+    maker = Maker(name='Foo')
+    db.session.add(maker)
+    for i in range(1, 11):
+        db.session.add(Heatsink(maker=maker, name='Bar {0}'.format(i),
+                                heatsink_type='tower', danawa_id=i))
+    db.session.add(Heatsink(maker=maker, name='Slow', heatsink_type='tower',
+                            danawa_id=999, price=1234))
+    db.session.add(Heatsink(maker=maker, name='Unknown',
+                            heatsink_type='tower'))
+    db.session.commit()
+
+    http_server.respond = danawa_response
+    app.config.update({
+        'DANAWA_API_KEY_PRODUCT_INFO': 'secret',
+        'DANAWA_FETCH_CONCURRENCY': 2,
+        'DANAWA_REQUEST_TIMEOUT': 0.2,
+    })
+    with patch('cpucoolerchart.crawler.DANAWA_PRODUCT_INFO_URL',
+               http_server.url + '/api/main/product/info'):
+        crawler.update_danawa_data()
+
+    for i in range(1, 11):
+        heatsink = Heatsink.query.find(name='Bar {0}'.format(i))
+        assert heatsink.price == i * 100
+        assert heatsink.shop_count == 3
+        assert heatsink.image_url == 'http://img/{0}.jpg'.format(i)
+    assert Heatsink.query.find(name='Slow').price == 1234
+    assert Heatsink.query.find(name='Unknown').price is None
+    # Connections are kept alive and reused
+    assert len(http_server.client_addresses) <= 3
+
+
+def test_connection_pool(http_server):
+    http_server.respond = lambda handler: (200, {'X-Foo': 'bar'},
+                                           to_bytes(handler.path))
+    pool = crawler.ConnectionPool(timeout=1, maxsize=1)
+    for i in range(5):
+        status, headers, body = pool.request(
+            http_server.url + '/path?n={0}'.format(i))
+        assert status == 200
+        assert headers['x-foo'] == 'bar'
+        assert body == to_bytes('/path?n={0}'.format(i))
+    assert len(http_server.client_addresses) == 1
+    pool.close()
+
+
+def test_get_cached_response_text_revalidation(app, db, http_server):
+    requests = []
+
+    def respond(handler):
+        requests.append(dict((k.lower(), v) for k, v
+                             in handler.headers.items()))
+        if handler.headers.get('If-None-Match') == '"v1"':
+            return 304, {'ETag': '"v1"'}, b''
+        return 200, {'ETag': '"v1"',
+                     'Last-Modified': 'Fri, 31 Jan 2014 00:00:00 GMT'}, b'abc'
+
+    http_server.respond = respond
+    app.config['UPDATE_INTERVAL'] = 600  # Stale as soon as it is cached
+    for pool in (None, crawler.ConnectionPool(timeout=1)):
+        del requests[:]
+        url = http_server.url + '/page?pool={0}'.format(pool is not None)
+        assert crawler.get_cached_response_text(url, pool) == b'abc'
+        assert crawler.get_cached_response_text(url, pool) == b'abc'
+        assert len(requests) == 2
+        assert 'if-none-match' not in requests[0]
+        assert requests[1]['if-none-match'] == '"v1"'
+        assert (requests[1]['if-modified-since'] ==
+                'Fri, 31 Jan 2014 00:00:00 GMT')
+
+    app.config['UPDATE_INTERVAL'] = 86400
+    del requests[:]
+    url = http_server.url + '/fresh'
+    assert crawler.get_cached_response_text(url) == b'abc'
+    assert crawler.get_cached_response_text(url) == b'abc'
+    assert len(requests) == 1
+
+
+def test_do_update_data_fixed_conflict(db):
+    get_page_html = crawler.get_page_html
+
+    def conflicting_weight(noise, power):
+        html = get_page_html(noise, power)
+        if (noise, power) == (35, 62):
+            html = html.replace(b'H110</td>\n<td align="center" width="1" '
+                                b'background="http://www.coolenjoy.net/image/'
+                                b'line_r.gif"></td>\n<td><br>Tower / 0g',
+                                b'H110</td>\n<td align="center" width="1" '
+                                b'background="http://www.coolenjoy.net/image/'
+                                b'line_r.gif"></td>\n<td><br>Tower / 900g')
+        return html
+
+    with patch('cpucoolerchart.crawler.get_page_html', conflicting_weight):
+        crawler.do_update_data()
+    assert Measurement.query.count() < 290
+
+    # Only one page changes, but the rows of the other pages that were
+    # removed due to the conflict are added back.
+    crawler.do_update_data()
+    assert Measurement.query.count() == 290
@@ -0,0 +1,70 @@
+import random
+
+from cpucoolerchart import crawler
+from cpucoolerchart.extensions import cache
+from cpucoolerchart.frontier import (Point, skyline, get_points,
+                                     get_frontier)
+
+from .conftest import get_json, set_prices
+
+
+def dominates(a, b):
+    return all(x <= y for x, y in zip(a[:3], b[:3])) and a[:3] != b[:3]
+
+
+def naive_skyline(points):
+    return [p for p in points if not any(dominates(q, p) for q in points)]
+
+
+def test_skyline():
+    rnd = random.Random(0)
+    for n in (0, 1, 2, 10, 200):
+        points = sorted(Point(rnd.choice([35, 40, 45, 100]),
+                              rnd.randint(30, 60), rnd.randint(1, 20) * 1000,
+                              i, i, i, None, None, None, None)
+                        for i in range(n))
+        assert skyline(points) == naive_skyline(points)
+    points = [Point(35, 50.0, 30000, i, i, i, None, None, None, None)
+              for i in range(3)]
+    assert skyline(points) == points
+
+
+def test_get_frontier(app, db):
+    crawler.update_data()
+    set_prices()
+    crawler.update_data(force=True)
+    points = get_frontier(150)
+    assert points
+    assert points == sorted(points)
+    assert all(point.price is not None for point in points)
+    all_points = get_points()[150][0]
+    assert points == naive_skyline(all_points)
+    assert get_frontier(150, price_max=15000) == naive_skyline(
+        [p for p in all_points if p.price <= 15000])
+    tower = get_frontier(150, heatsink_type='tower')
+    assert tower and all(p.heatsink_type == 'tower' for p in tower)
+    assert get_frontier(151) == []
+
+
+def test_frontier_view(app, db):
+    client = app.test_client()
+    crawler.update_data()
+    set_prices()
+    crawler.update_data(force=True)
+    cache.clear()
+    data = get_json(client, '/frontier?power=150')
+    assert [item['measurement_id'] for item in data['items']] == [
+        point.measurement_id for point in get_frontier(150)]
+    assert data['count'] == len(data['items'])
+    keys = [(item['noise'], item['cpu_temp_delta'], item['price'])
+            for item in data['items']]
+    assert not any(dominates(a, b) for a in keys for b in keys)
+
+    data = get_json(client, '/frontier?power=150&fan_size=120&price_max=20000')
+    assert [item['measurement_id'] for item in data['items']] == [
+        point.measurement_id
+        for point in get_frontier(150, fan_size=120, price_max=20000)]
+
+    assert get_json(client, '/frontier', 400)['msg'] == 'power is required'
+    assert get_json(client, '/frontier?power=150&fan_size=x', 400)['msg'] == (
+        'invalid value for fan_size: x')
@@ -0,0 +1,92 @@
+from mock import patch
+import pytest
+
+from cpucoolerchart import crawler
+from cpucoolerchart.extensions import cache
+from cpucoolerchart.interpolation import build_grids, get_grids, interpolate
+from cpucoolerchart.models import Measurement
+
+from .conftest import get_json
+
+numpy = pytest.importorskip('numpy')
+
+
+def temps(fan_config_id):
+    return dict(((m.noise, m.power), m.cpu_temp_delta) for m in
+                Measurement.query.filter_by(fan_config_id=fan_config_id))
+
+
+def test_build_grids(app, db):
+    crawler.update_data()
+    grids = get_grids()
+    assert get_grids() is grids
+    assert grids['cpu_temp_delta'].shape == (
+        len(grids['fan_config_id']), 3, 4)
+    m = Measurement.query.filter_by(noise=40, power=150).first()
+    i = grids['fan_config_id'].tolist().index(m.fan_config_id)
+    assert grids['cpu_temp_delta'][i, 1, 2] == m.cpu_temp_delta
+    assert numpy.isnan(grids['cpu_temp_delta'][i, 0, 3])
+    with patch('cpucoolerchart.interpolation.numpy', None):
+        assert build_grids(1) is None
+
+
+def test_interpolate(app, db):
+    crawler.update_data()
+    grids = get_grids()
+    m = Measurement.query.filter_by(noise=40, power=150).first()
+    t = temps(m.fan_config_id)
+    f = m.fan_config_id
+    assert interpolate(grids, f, 40, 150) == pytest.approx(t[40, 150])
+    assert interpolate(grids, f, 45, 200) == pytest.approx(t[45, 200])
+    assert interpolate(grids, f, 37.5, 150) == pytest.approx(
+        (t[35, 150] + t[40, 150]) / 2)
+    assert interpolate(grids, f, 42, 121) == pytest.approx(
+        t[40, 92] * 0.6 * 0.5 + t[45, 92] * 0.4 * 0.5 +
+        t[40, 150] * 0.6 * 0.5 + t[45, 150] * 0.4 * 0.5)
+    # (40, 200) is not measured.
+    assert numpy.isnan(interpolate(grids, f, 40, 180))
+    assert numpy.isnan(interpolate(grids, f, 34, 150))
+    assert numpy.isnan(interpolate(grids, f, 40, 201))
+    assert numpy.isnan(interpolate(grids, 10 ** 6, 40, 150))
+
+    ids = grids['fan_config_id']
+    queries = numpy.random.RandomState(0).uniform(size=(2, 1000))
+    noise = 35 + queries[0] * 10
+    power = 62 + queries[1] * 88
+    values = interpolate(grids, ids[numpy.arange(1000) % len(ids)], noise,
+                         power)
+    assert values.shape == (1000,)
+    for k in (0, 1, 999):
+        expected = interpolate(grids, ids[k % len(ids)], noise[k], power[k])
+        assert numpy.allclose(values[k], expected, equal_nan=True)
+
+
+def test_estimates_view(app, db):
+    client = app.test_client()
+    crawler.update_data()
+    data = get_json(client, '/estimates?noise=37.5&power=150')
+    assert data['count'] > 0
+    values = [item['cpu_temp_delta'] for item in data['items']]
+    assert values == sorted(values)
+    item = data['items'][0]
+    t = temps(item['fan_config_id'])
+    assert item['cpu_temp_delta'] == round(
+        (t[35, 150] + t[40, 150]) / 2, 1)
+
+    m = Measurement.query.filter_by(noise=40, power=150).first()
+    data = get_json(client, '/estimates?noise=40&power=150&'
+                    'fan_config_id={0}&fan_config_id=1000000'.format(
+                        m.fan_config_id))
+    assert data['items'] == [{'fan_config_id': m.fan_config_id,
+                              'cpu_temp_delta': m.cpu_temp_delta}]
+
+    assert get_json(client, '/estimates?noise=40', 400)['msg'] == (
+        'power is required')
+    assert get_json(client, '/estimates?noise=50&power=100', 400)['msg'] == (
+        'invalid value for noise: 50')
+    assert get_json(client, '/estimates?noise=40&power=100&fan_config_id=x',
+                    400)
+
+    cache.clear()
+    with patch('cpucoolerchart.views.get_grids', return_value=None):
+        assert get_json(client, '/estimates?noise=40&power=100', 503)
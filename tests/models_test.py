@@ -28,3 +28,35 @@ def test_base_query_find(db):
     db.session.add(person)
     db.session.commit()
     assert Person.query.find(name='John') == person
+
+
+def test_base_query_all_as_columns(db):
+    db.session.add(Person(name='John', age=24))
+    db.session.add(Person(name='Jane'))
+    db.session.commit()
+    columns = Person.query.order_by(Person.name).all_as_columns()
+    assert list(columns.items()) == [('name', ['Jane', 'John']),
+                                     ('age', [None, 24])]
+    columns = Person.query.filter(Person.age > 30).all_as_columns()
+    assert columns == {'name': [], 'age': []}
+
+
+def test_base_column_names(db):
+    assert Person._column_names() == ('name', 'age')
+    assert Person._column_names() is Person(name='John')._column_names()
+    attributes = Person._column_attributes()
+    assert attributes[0] is Person.name and attributes[1] is Person.age
+
+
+def test_base_query_all_as_dict(db):
+    db.session.add(Person(name='John', age=24))
+    db.session.add(Person(name='Jane'))
+    db.session.commit()
+    db.session.expunge_all()
+    rows = Person.query.order_by(Person.name).all_as_dict()
+    assert rows == [{'name': 'Jane', 'age': None},
+                    {'name': 'John', 'age': 24}]
+    assert len(db.session.identity_map) == 0
+    assert rows == [person.as_dict()
+                    for person in Person.query.order_by(Person.name)]
+    assert Person.query.filter(Person.age > 30).all_as_dict() == []
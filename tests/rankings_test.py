@@ -0,0 +1,108 @@
+from sqlalchemy import event
+
+from cpucoolerchart import crawler
+from cpucoolerchart.extensions import cache
+from cpucoolerchart.models import Heatsink, FanConfig, Measurement
+from cpucoolerchart.rankings import Ranking, get_rankings
+
+from .conftest import get_json
+
+
+def sorted_entries(noise, power):
+    entries = []
+    for m in Measurement.query.filter_by(noise=noise, power=power):
+        heatsink = m.fan_config.heatsink
+        entries.append((m.cpu_temp_delta, m.id, m.fan_config_id, heatsink.id,
+                        heatsink.price))
+    return sorted(entries)
+
+
+def test_ranking():
+    ranking = Ranking([
+        (40.0, 1, 1, 1, None),
+        (41.5, 2, 2, 2, 30000),
+        (41.5, 3, 3, 1, 20000),
+        (45.0, 4, 4, 3, 10000),
+    ])
+    assert len(ranking) == 4
+    assert [ranking.rank(i) for i in range(4)] == [1, 2, 2, 4]
+    assert ranking.top(2) == [0, 1]
+    assert ranking.top(10) == [0, 1, 2, 3]
+    assert ranking.top(2, price_max=20000) == [2, 3]
+    assert ranking.top(2, price_max=5000) == []
+    assert ranking.heatsink_index(1) == 0
+    assert ranking.heatsink_index(3) == 3
+    assert ranking.heatsink_index(4) is None
+    assert ranking.as_dict(2) == {
+        'rank': 2, 'measurement_id': 3, 'fan_config_id': 3, 'heatsink_id': 1,
+        'cpu_temp_delta': 41.5, 'price': 20000}
+
+
+def test_update_data_builds_rankings(app, db):
+    crawler.update_data()
+    rankings = cache.get('rankings/1')
+    assert len(rankings) == 14
+    assert sum(len(ranking) for ranking in rankings.values()) == 290
+    for (noise, power), ranking in rankings.items():
+        assert ranking.entries == sorted_entries(noise, power)
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        loaded = get_rankings()
+        assert get_rankings() is loaded
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert statements == []
+    assert sorted(loaded) == sorted(rankings)
+    for key, ranking in loaded.items():
+        assert ranking.entries == rankings[key].entries
+
+
+def test_rankings_view(app, db):
+    client = app.test_client()
+    crawler.update_data()
+    for i, heatsink in enumerate(Heatsink.query):
+        heatsink.price = (i % 7) * 10000 or None
+    db.session.commit()
+    cache.clear()
+
+    entries = sorted_entries(40, 150)
+    data = get_json(client, '/rankings?noise=40&power=150')
+    assert data['total'] == len(entries) == 25
+    assert data['count'] == 10
+    assert ([x['measurement_id'] for x in data['items']] ==
+            [entry[1] for entry in entries[:10]])
+    assert data['items'][0]['rank'] == 1
+
+    data = get_json(client, '/rankings?noise=40&power=150&limit=5&'
+                    'price_max=30000')
+    expected = [entry for entry in entries
+                if entry[4] is not None and entry[4] <= 30000][:5]
+    assert [x['measurement_id'] for x in data['items']] == [
+        entry[1] for entry in expected]
+    temps = [entry[0] for entry in entries]
+    assert [x['rank'] for x in data['items']] == [
+        temps.index(entry[0]) + 1 for entry in expected]
+
+    heatsink_id = entries[-1][3]
+    best = [entry for entry in entries if entry[3] == heatsink_id][0]
+    data = get_json(client, '/rankings?noise=40&power=150&heatsink_id={0}'
+                    .format(heatsink_id))
+    assert data['count'] == 1
+    assert data['items'][0]['measurement_id'] == best[1]
+    assert data['items'][0]['fan_config_id'] == FanConfig.query.get(
+        best[2]).id
+
+    data = get_json(client, '/rankings?noise=41&power=150')
+    assert data['total'] == data['count'] == 0
+    assert get_json(client, '/rankings?noise=40', 400)['msg'] == (
+        'power is required')
+    assert get_json(client, '/rankings?noise=40&power=150&limit=0', 400)
+    assert get_json(client, '/rankings?noise=40&power=150&heatsink_id=1&'
+                    'limit=3', 400)
@@ -0,0 +1,119 @@
+from mock import patch
+import pytest
+
+from cpucoolerchart import crawler
+from cpucoolerchart.extensions import cache
+from cpucoolerchart.models import Measurement
+from cpucoolerchart.scoring import (SCORE_COLUMNS, build_scores, get_scores,
+                                    scores_of)
+from cpucoolerchart.views import export_data
+
+from .conftest import get_json, set_prices
+
+numpy = pytest.importorskip('numpy')
+
+
+def expected_scores():
+    groups = {}
+    for m in Measurement.query:
+        groups.setdefault((m.noise, m.power), []).append(m)
+    expected = {}
+    for members in groups.values():
+        temps = [m.cpu_temp_delta for m in members]
+        mean = sum(temps) / len(temps)
+        std = (sum((mean - t) ** 2 for t in temps) / len(temps)) ** 0.5
+        for m in members:
+            headroom = max(temps) - m.cpu_temp_delta
+            price = m.fan_config.heatsink.price
+            expected[m.id] = (
+                round(headroom, 1),
+                round(headroom / price * 10000, 4) if price else None,
+                round((mean - m.cpu_temp_delta) / std, 3) if std else 0.0,
+            )
+    return expected
+
+
+def assert_scores_equal(actual, expected):
+    for a, b in zip(actual, expected):
+        if b is None:
+            assert a is None
+        else:
+            assert a == pytest.approx(b, abs=1e-3)
+
+
+def test_build_scores(app, db):
+    crawler.update_data()
+    set_prices()
+    crawler.update_data(force=True)
+    scores = get_scores()
+    assert get_scores() is scores
+    ids = [m.id for m in Measurement.query.order_by(Measurement.id)]
+    assert scores['measurement_id'].tolist() == ids
+    expected = expected_scores()
+    assert len(expected) == 290
+    for measurement_id, values in zip(ids, scores_of(scores, ids)):
+        assert_scores_equal(values, expected[measurement_id])
+    assert scores_of(scores, [ids[-1] + 1]) == [(None, None, None)]
+
+
+def test_build_scores_empty(app, db):
+    scores = get_scores()
+    assert len(scores['measurement_id']) == 0
+    assert scores_of(scores, [1, 2]) == [(None, None, None)] * 2
+
+
+def test_scores_view(app, db):
+    client = app.test_client()
+    crawler.update_data()
+    set_prices()
+    crawler.update_data(force=True)
+    expected = expected_scores()
+
+    items = get_json(client, '/scores')['items']
+    assert len(items) == 290
+    for item in items:
+        assert_scores_equal([item[name] for name in SCORE_COLUMNS],
+                            expected[item['measurement_id']])
+
+    data = get_json(client, '/scores?format=columnar')
+    assert data['count'] == 290
+    assert data['columns']['measurement_id'] == [
+        item['measurement_id'] for item in items]
+    assert list(data['nulls']) == ['headroom_per_10k_krw']
+    assert get_json(client, '/scores?format=rows', 400)
+
+
+def test_scores_view_without_numpy(app, db):
+    client = app.test_client()
+    crawler.update_data()
+    cache.clear()
+    with patch('cpucoolerchart.views.get_scores', return_value=None):
+        assert get_json(client, '/scores', 503)['msg'] == (
+            'numpy is not installed')
+        assert client.get('/all?scores=1').status_code == 503
+    with patch('cpucoolerchart.scoring.numpy', None):
+        assert build_scores(1) is None
+
+
+def test_export_scores(app, db):
+    client = app.test_client()
+    crawler.update_data()
+    set_prices()
+    crawler.update_data(force=True)
+    expected = expected_scores()
+
+    lines = export_data(scores=get_scores()).split('\n')
+    header = lines[0].split(',')
+    assert header[-3:] == SCORE_COLUMNS
+    assert len(lines) == 291
+    plain = export_data().split('\n')
+    assert [line.split(',')[:-3] for line in lines] == [
+        line.split(',') for line in plain]
+    convert = lambda x: '' if x is None else str(x)
+    assert sorted(line.split(',')[-3:] for line in lines[1:]) == sorted(
+        [convert(x) for x in values] for values in expected.values())
+
+    r = client.get('/all?scores=1')
+    assert r.status_code == 200
+    assert r.data.decode('utf-8') == '\n'.join(lines)
+    assert client.get('/all?scores=2').status_code == 400
@@ -0,0 +1,378 @@
+from datetime import timedelta
+import json
+import threading
+import time
+import zlib
+
+from mock import patch
+import pytest
+from sqlalchemy import event
+from werkzeug.http import http_date
+
+from cpucoolerchart import crawler, snapshots
+from cpucoolerchart._compat import to_native
+from cpucoolerchart.extensions import cache
+from cpucoolerchart.models import Maker
+from cpucoolerchart.snapshots import get_data_version, publish_data_version
+
+from .conftest import fill_data, get_json
+
+
+def test_get_data_version(db):
+    assert get_data_version() == (0, None)
+    crawler.update_data()
+    version, created_at = get_data_version()
+    assert version == 1
+    assert created_at is not None
+    cache.clear()
+    assert get_data_version() == (version, created_at)
+
+
+def test_update_data_publishes_snapshots(app, db):
+    client = app.test_client()
+    assert get_json(client, '/makers')['count'] == 0
+    crawler.update_data()
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        assert get_json(client, '/makers')['count'] == 12
+        assert get_json(client, '/measurements')['count'] == 290
+        r = client.get('/all')
+        assert r.status_code == 200
+        assert len(r.data.splitlines()) == 291
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert statements == []
+
+
+def test_snapshot_fallback(app, db):
+    client = app.test_client()
+    fill_data()
+    assert get_json(client, '/makers')['count'] == 2
+    db.session.add(Maker(name='Zalman'))
+    db.session.commit()
+    assert get_json(client, '/makers')['count'] == 2
+    publish_data_version()
+    assert get_json(client, '/makers')['count'] == 3
+    cache.clear()
+    assert get_json(client, '/makers')['count'] == 3
+    r = client.get('/makers')
+    assert r.headers['Access-Control-Allow-Origin'] == '*'
+
+
+def test_unpublished_data_not_stored(app, db):
+    client = app.test_client()
+    crawler.update_data()
+    get_page_html = crawler.get_page_html
+
+    def change_one_page(noise, power):
+        html = get_page_html(noise, power)
+        if (noise, power) == (35, 62):
+            html = html.replace(b'<b>43.5<b>', b'<b>42.0<b>')
+        return html
+
+    with patch('cpucoolerchart.crawler.get_page_html', change_one_page):
+        with patch('cpucoolerchart.crawler.update_danawa_data',
+                   side_effect=RuntimeError):
+            crawler.update_data(force=True)
+    assert get_data_version()[0] == 1
+    path = '/measurements?noise=35&power=62'
+    key = 'snapshot/1/measurements?noise=35&power=62'
+    temps = [x['cpu_temp_delta'] for x in get_json(client, path)['items']]
+    assert 42.0 in temps
+    assert cache.get(key) is None
+    assert cache.get('rankings/1') is not None
+
+    crawler.update_data(force=True)
+    assert get_data_version()[0] == 1
+    temps = [x['cpu_temp_delta'] for x in get_json(client, path)['items']]
+    assert 42.0 not in temps
+    assert cache.get(key) is not None
+
+
+def test_conditional_requests(app, db):
+    client = app.test_client()
+    r = client.get('/measurements')
+    assert 'ETag' not in r.headers
+
+    crawler.update_data()
+    version, created_at = get_data_version()
+    for path in ('/makers', '/heatsinks', '/fan-configs', '/measurements',
+                 '/all'):
+        r = client.get(path)
+        assert r.status_code == 200
+        assert r.headers['ETag'] == '"v{0}"'.format(version)
+        assert r.headers['Last-Modified'] == http_date(created_at)
+        assert 'no-cache' in r.headers['Cache-Control']
+
+    with patch.object(cache, 'get', wraps=cache.get) as cache_get:
+        r = client.get('/measurements',
+                       headers={'If-None-Match': '"v{0}"'.format(version)})
+        assert r.status_code == 304
+        assert r.data == b''
+        assert r.headers['ETag'] == '"v{0}"'.format(version)
+        assert r.headers['Access-Control-Allow-Origin'] == '*'
+        assert [args[0] for args, kwargs in cache_get.call_args_list] == [
+            'data_version']
+
+    r = client.get('/measurements', headers={'If-None-Match': '"v0"'})
+    assert r.status_code == 200
+    r = client.get('/all', headers={
+        'If-Modified-Since': http_date(created_at)})
+    assert r.status_code == 304
+    r = client.get('/all', headers={
+        'If-Modified-Since': http_date(created_at - timedelta(days=1))})
+    assert r.status_code == 200
+    r = client.get('/all', headers={
+        'If-None-Match': '"v0"',
+        'If-Modified-Since': http_date(created_at)})
+    assert r.status_code == 200
+
+
+def test_compressed_variants(app, db):
+    app.config['SNAPSHOT_ENCODINGS'] = ('gzip', 'deflate')
+    client = app.test_client()
+    crawler.update_data()
+    identity = client.get('/measurements')
+    assert 'Content-Encoding' not in identity.headers
+    assert 'Accept-Encoding' in identity.vary
+
+    r = client.get('/measurements', headers={'Accept-Encoding': 'gzip'})
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in r.vary
+    assert r.headers['ETag'] != identity.headers['ETag']
+    assert len(r.data) < len(identity.data) // 5
+    assert zlib.decompress(r.data, 16 + zlib.MAX_WBITS) == identity.data
+
+    r = client.get('/all', headers={
+        'Accept-Encoding': 'deflate;q=1, gzip;q=0.5'})
+    assert r.headers['Content-Encoding'] == 'deflate'
+    assert zlib.decompress(r.data) == client.get('/all').data
+
+    r = client.get('/all', headers={'Accept-Encoding': 'gzip'})
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert (zlib.decompress(r.data, 16 + zlib.MAX_WBITS) ==
+            client.get('/all').data)
+
+    r = client.get('/measurements', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': identity.headers['ETag']})
+    assert r.status_code == 200
+    etag = r.headers['ETag']
+    r = client.get('/measurements', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert r.status_code == 304
+    assert r.headers['ETag'] == etag
+
+    cache.clear()
+    r = client.get('/makers', headers={'Accept-Encoding': 'gzip'})
+    assert r.headers['Content-Encoding'] == 'gzip'
+    data = zlib.decompress(r.data, 16 + zlib.MAX_WBITS)
+    assert json.loads(to_native(data))['count'] == 12
+
+
+def test_streamed_snapshots(app, db):
+    app.config['SNAPSHOT_ENCODINGS'] = ('gzip',)
+    client = app.test_client()
+    crawler.update_data()
+    body = client.get('/all').data
+    for headers in ({}, {'Accept-Encoding': 'gzip'}):
+        cache.clear()
+        r = client.get('/all', headers=headers)
+        assert 'Content-Length' not in r.headers
+        data = r.data
+        r.close()
+        if headers:
+            assert r.headers['Content-Encoding'] == 'gzip'
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        assert data == body
+        assert cache.get('lock/snapshot/1/all') is None
+        assert cache.get('snapshot/1/all')[1] == body
+        r = client.get('/all', headers=headers)
+        assert 'Content-Length' in r.headers
+
+
+def test_query_snapshots(app, db):
+    app.config['SNAPSHOT_ENCODINGS'] = ('gzip', 'deflate')
+    client = app.test_client()
+    crawler.update_data()
+    path = '/measurements?noise=40&power=150'
+    with patch.object(cache, 'set', wraps=cache.set) as cache_set:
+        identity = client.get(path)
+        r = client.get(path, headers={'Accept-Encoding': 'gzip'})
+    assert [(args[0], kwargs['timeout'])
+            for args, kwargs in cache_set.call_args_list] == [
+        ('snapshot/1/measurements?noise=40&power=150', 600)]
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert r.headers['ETag'] == '"v1-gzip"'
+    assert zlib.decompress(r.data, 16 + zlib.MAX_WBITS) == identity.data
+    assert json.loads(to_native(identity.data))['count'] == 25
+
+
+def test_msgpack_variants(app, db):
+    msgpack = pytest.importorskip('msgpack')
+    app.config['SNAPSHOT_ENCODINGS'] = ('gzip',)
+    client = app.test_client()
+    crawler.update_data()
+    for path in ('/heatsinks', '/measurements?noise=40&format=columnar'):
+        json_resp = client.get(path)
+        r = client.get(path, headers={'Accept': 'application/msgpack'})
+        assert r.status_code == 200
+        assert r.mimetype == 'application/msgpack'
+        assert 'Accept' in r.vary
+        assert r.headers['ETag'] != json_resp.headers['ETag']
+        if msgpack.version < (0, 5, 2):
+            data = msgpack.unpackb(r.data, encoding='utf-8')
+        else:
+            data = msgpack.unpackb(r.data, raw=False)
+        assert data == json.loads(to_native(json_resp.data))
+
+        r2 = client.get(path, headers={'Accept': 'application/msgpack',
+                                       'Accept-Encoding': 'gzip'})
+        assert r2.headers['Content-Encoding'] == 'gzip'
+        assert zlib.decompress(r2.data, 16 + zlib.MAX_WBITS) == r.data
+
+        r3 = client.get(path, headers={'Accept': 'application/msgpack',
+                                       'If-None-Match': r.headers['ETag']})
+        assert r3.status_code == 304
+
+    version, created_at = get_data_version()
+    with patch.object(cache, 'get', wraps=cache.get) as cache_get:
+        r = client.get('/makers', headers={
+            'Accept': 'application/json;q=0.5, application/msgpack'})
+        assert r.mimetype == 'application/msgpack'
+        assert cache_get.call_args_list[-1][0][0] == (
+            'snapshot/{0}/makers:msgpack'.format(version))
+    r = client.get('/makers', headers={
+        'Accept': 'application/json, application/msgpack;q=0.5'})
+    assert r.mimetype == 'application/json'
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for i in range(3):
+            r = client.get('/all', headers={'Accept': 'application/msgpack'})
+            assert r.mimetype == 'text/csv'
+            assert r.headers['ETag'] == '"v{0}"'.format(version)
+            assert 'Accept' not in r.vary
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert statements == []
+
+
+def test_msgpack_not_installed(app, db):
+    client = app.test_client()
+    crawler.update_data()
+    with patch.object(snapshots, 'msgpack', None):
+        r = client.get('/makers', headers={'Accept': 'application/msgpack'})
+        assert r.mimetype == 'application/json'
+        assert 'Accept' not in r.vary
+
+
+def test_snapshots_served_from_local_cache(app, db):
+    client = app.test_client()
+    crawler.update_data()
+    client.get('/heatsinks')
+    backend = cache.cache.backend
+    with patch.object(backend, 'get', wraps=backend.get) as get:
+        r = client.get('/heatsinks')
+        assert r.status_code == 200
+        assert get.call_count == 0
+
+
+def test_single_flight(app, db):
+    crawler.update_data()
+    cache.clear()
+    renders = []
+
+    def slow_render(conn, cursor, statement, *args):
+        if 'FROM measurement' in statement:
+            renders.append(statement)
+            time.sleep(0.2)
+
+    def fetch(results):
+        start.wait()
+        with app.app_context():
+            r = app.test_client().get('/measurements')
+            results.append((r.status_code, r.data))
+
+    engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', slow_render)
+    start = threading.Event()
+    results = []
+    threads = [threading.Thread(target=fetch, args=(results,))
+               for _ in range(20)]
+    try:
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        event.remove(engine, 'before_cursor_execute', slow_render)
+    assert len(results) == 20
+    assert set(results) == set([results[0]])
+    assert results[0][0] == 200
+    assert len(renders) == 1
+
+
+def test_single_flight_gives_up_waiting(app, db):
+    app.config['SNAPSHOT_LOCK_WAIT'] = 0.2
+    client = app.test_client()
+    crawler.update_data()
+    cache.clear()
+    cache.set('lock/snapshot/1/makers', 'abandoned')
+    assert get_json(client, '/makers')['count'] == 12
+
+
+def test_refresh_ahead(app, db):
+    client = app.test_client()
+    crawler.update_data()
+    key = 'snapshot/1/makers'
+    assert cache.get(key)[2] > time.time() + 86400
+
+    db.session.add(Maker(name='Nobrand'))
+    db.session.commit()
+    headers, body, refresh_at = cache.get(key)
+    cache.set(key, (headers, body, time.time() - 1))
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        # Not refreshed while another request holds the lock
+        cache.set('lock/snapshot/1/makers', 'taken')
+        r = client.get('/makers')
+        time.sleep(0.1)
+        assert cache.get(key)[2] < time.time()
+        cache.delete('lock/snapshot/1/makers')
+
+        # The snapshot is stored again as it is, without rendering it.
+        with patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            r = client.get('/makers')
+            assert r.data == body
+            deadline = time.time() + 5
+            while cache.get(key)[2] < time.time():
+                assert time.time() < deadline
+                time.sleep(0.01)
+            assert cache_set.call_args[1]['timeout'] == 86400 * 7
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert statements == []
+    assert r.headers['ETag'] == '"v1"'
+    assert cache.get(key)[1] == body
+    assert cache.get(key)[2] > time.time() + 86400
+    assert cache.get('lock/snapshot/1/makers') is None
+    assert get_json(client, '/makers')['count'] == 12
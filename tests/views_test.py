@@ -1,14 +1,18 @@
+import base64
 from datetime import timedelta
 import json
 
 from flask import Flask, request, make_response
 from mock import patch, MagicMock
+from sqlalchemy import event
 
 from cpucoolerchart import crawler
 from cpucoolerchart._compat import to_native
 from cpucoolerchart.crawler import update_data
 from cpucoolerchart.extensions import db, cache
-from cpucoolerchart.views import crossdomain
+from cpucoolerchart.models import Maker, FanConfig, Heatsink, Measurement
+from cpucoolerchart.views import (crossdomain, export_data, iter_export_data,
+                                  filter_measurements)
 import cpucoolerchart.views
 
 from .conftest import app, read_file, fill_data
@@ -165,12 +169,205 @@ class TestViews(object):
             }]
         }
 
+    def test_view_func_measurements_filters(self):
+        update_data()
+        for heatsink in Heatsink.query.filter(Heatsink.id % 2 == 0):
+            heatsink.price = heatsink.id * 1000
+        db.session.commit()
+        fan_configs = dict((x.id, x) for x in FanConfig.query)
+        everything = json.loads(to_native(
+            self.client.get('/measurements').data))['items']
+
+        def get_items(query_string):
+            r = self.client.get('/measurements?' + query_string)
+            assert r.status_code == 200
+            data = json.loads(to_native(r.data))
+            assert data['count'] == len(data['items'])
+            return sorted(x['id'] for x in data['items'])
+
+        def expected_items(pred):
+            return sorted(x['id'] for x in everything if pred(x))
+
+        assert get_items('noise=40&power=150') == expected_items(
+            lambda x: x['noise'] == 40 and x['power'] == 150)
+        assert get_items('power=150&cpu_temp_delta_max=60') == (
+            expected_items(lambda x: x['power'] == 150 and
+                           x['cpu_temp_delta'] <= 60))
+        assert get_items('fan_size=120&fan_count=2') == expected_items(
+            lambda x: fan_configs[x['fan_config_id']].fan_size == 120 and
+            fan_configs[x['fan_config_id']].fan_count == 2)
+        heatsinks = [fc.heatsink for fc in fan_configs.values()]
+        maker = heatsinks[0].maker.name
+        assert get_items('maker=' + maker) == expected_items(
+            lambda x: fan_configs[x['fan_config_id']].heatsink.maker.name ==
+            maker)
+        prices = dict((x.id, x.heatsink.price) for x in fan_configs.values())
+        assert get_items('price_min=10000&price_max=30000') == (
+            expected_items(lambda x: prices[x['fan_config_id']] is not None and
+                           10000 <= prices[x['fan_config_id']] <= 30000))
+        assert get_items('heatsink_type=flower') == expected_items(
+            lambda x: fan_configs[x['fan_config_id']].heatsink.heatsink_type ==
+            'flower')
+        assert get_items('noise=40&foo=bar') == get_items('noise=40')
+
+        r = self.client.get('/measurements?noise=loud')
+        assert r.status_code == 400
+        assert (json.loads(to_native(r.data))['msg'] ==
+                'invalid value for noise: loud')
+
+    def test_view_func_measurements_filters_cache(self):
+        update_data()
+        r = self.client.get('/measurements?power=150&noise=40')
+        assert r.status_code == 200
+        with patch.object(cache, 'get', wraps=cache.get) as cache_get:
+            r2 = self.client.get('/measurements?noise=040&power=150&x=1')
+            assert r2.data == r.data
+            assert cache_get.call_args_list[-1][0][0] == (
+                'snapshot/1/measurements?noise=40&power=150')
+
+    def test_measurement_filters_use_indexes(self):
+        update_data()
+        query = filter_measurements(Measurement.query, {
+            'noise': 40, 'power': 150, 'cpu_temp_delta_max': 50.0,
+            'fan_size': 120, 'heatsink_type': 'tower'})
+        plan = db.session.execute(
+            'EXPLAIN QUERY PLAN ' + str(query.statement.compile(
+                compile_kwargs={'literal_binds': True}))).fetchall()
+        plan = ' '.join(row[-1] for row in plan)
+        assert 'ix_measurement_noise_power_cpu_temp_delta' in plan
+        assert 'SCAN' not in plan
+
+    def test_view_func_pagination(self):
+        update_data()
+        for path in ('/heatsinks', '/fan-configs', '/measurements?noise=40'):
+            everything = json.loads(to_native(
+                self.client.get(path).data))['items']
+            sep = '&' if '?' in path else '?'
+            ids = []
+            after = None
+            while True:
+                query_string = 'limit=20'
+                if after is not None:
+                    query_string += '&after={0}'.format(after)
+                r = self.client.get(path + sep + query_string)
+                assert r.status_code == 200
+                data = json.loads(to_native(r.data))
+                assert data['count'] == len(data['items']) <= 20
+                ids.extend(item['id'] for item in data['items'])
+                after = data['next']
+                if after is None:
+                    break
+                assert after == ids[-1]
+            assert ids == sorted(x['id'] for x in everything)
+
+        data = json.loads(to_native(
+            self.client.get('/measurements?after=10').data))
+        assert data['items'][0]['id'] == 11
+        assert data['count'] == 100
+        assert data['next'] == 110
+        for query_string in ('limit=0', 'limit=1001', 'limit=x', 'after=-1'):
+            r = self.client.get('/heatsinks?' + query_string)
+            assert r.status_code == 400
+
+    def test_view_func_columnar(self):
+        update_data()
+        for path in ('/heatsinks', '/fan-configs', '/measurements?noise=40',
+                     '/heatsinks?limit=7', '/measurements?after=3&limit=50'):
+            sep = '&' if '?' in path else '?'
+            rows = json.loads(to_native(self.client.get(path).data))
+            r = self.client.get(path + sep + 'format=columnar')
+            assert r.status_code == 200
+            data = json.loads(to_native(r.data))
+            assert data['count'] == rows['count']
+            assert data.get('next') == rows.get('next')
+            assert 'items' not in data
+            items = []
+            for i in range(data['count']):
+                item = {}
+                for name, values in data['columns'].items():
+                    if name in data['nulls']:
+                        bitmap = bytearray(base64.b64decode(
+                            data['nulls'][name]))
+                        if bitmap[i // 8] & (1 << (i % 8)):
+                            item[name] = None
+                            continue
+                    item[name] = values.pop(0)
+                items.append(item)
+            assert all(values == [] for values in data['columns'].values())
+            assert items == rows['items']
+            assert len(r.data) < len(self.client.get(path).data)
+
+        r = self.client.get('/heatsinks?format=csv')
+        assert r.status_code == 400
+
+    def test_view_func_chart(self):
+        update_data()
+        db.session.add(Maker(name='Nobody'))
+        db.session.commit()
+        cache.clear()
+
+        def get_items(path):
+            return json.loads(to_native(self.client.get(path).data))['items']
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db.get_engine(self.app)
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            r = self.client.get('/chart')
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        assert r.status_code == 200
+        assert r.headers['Access-Control-Allow-Origin'] == '*'
+        assert len([x for x in statements if 'JOIN' in x]) == 1
+        data = json.loads(to_native(r.data))
+
+        makers = get_items('/makers')
+        heatsinks = get_items('/heatsinks')
+        fan_configs = get_items('/fan-configs')
+        measurements = get_items('/measurements')
+        assert data['count'] == len(makers) == 13
+        assert [maker['name'] for maker in data['items']] == sorted(
+            maker['name'] for maker in makers)
+        joined = {'heatsinks': [], 'fan_configs': [], 'measurements': []}
+        for maker in data['items']:
+            if maker['name'] == 'Nobody':
+                assert maker['heatsinks'] == []
+            for heatsink in maker.pop('heatsinks'):
+                for fan_config in heatsink.pop('fan_configs'):
+                    for measurement in fan_config.pop('measurements'):
+                        measurement['fan_config_id'] = fan_config['id']
+                        joined['measurements'].append(measurement)
+                    fan_config['heatsink_id'] = heatsink['id']
+                    joined['fan_configs'].append(fan_config)
+                heatsink['maker_id'] = maker['id']
+                joined['heatsinks'].append(heatsink)
+        key = lambda item: item['id']
+        assert sorted(data['items'], key=key) == sorted(makers, key=key)
+        for name, items in (('heatsinks', heatsinks),
+                            ('fan_configs', fan_configs),
+                            ('measurements', measurements)):
+            assert (sorted(joined[name], key=key) ==
+                    sorted(items, key=key))
+
     def test_view_func_all(self):
         fill_data()
         r = self.client.get('/all')
         assert r.status_code == 200
         assert r.data + b'\n' == read_file('mock.csv')
 
+    def test_iter_export_data(self):
+        update_data()
+        chunks = list(iter_export_data(batch_size=100))
+        assert len(chunks) == 4
+        assert chunks[0].startswith('maker,model,')
+        assert all(chunk.startswith('\n') for chunk in chunks[1:])
+        assert ''.join(chunks) == export_data()
+        assert export_data().count('\n') == 290
+
     @patch('cpucoolerchart.views.update_queue')
     @patch('cpucoolerchart.views.is_update_needed', autospec=True)
     def test_view_func_update(self, is_update_needed, update_queue):